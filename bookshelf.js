@@ -2,14 +2,32 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
-let config = require('./knexfile');
-let knex = require('knex')(config);
+let knex = require('./db');
 let bookshelf = require('bookshelf')(knex);
 
 bookshelf.plugin('virtuals');
 bookshelf.plugin('visibility');
 
-knex.migrate.latest();
+bookshelf.Model = bookshelf.Model.extend({
+    /**
+     * Value of a column holding JSON, the text itself if it isn't valid JSON.
+     * It is parsed once per model instance, again only if the text changes.
+     */
+    parseJson(column) {
+        let text = this.get(column);
+        let parsed = this._parsedJson || (this._parsedJson = {});
+        if (parsed[column] && parsed[column].text === text)
+            return parsed[column].value;
+        let value;
+        try {
+            value = JSON.parse(text);
+        } catch (e) {
+            value = text;
+        }
+        parsed[column] = {text: text, value: value};
+        return value;
+    }
+});
 
 module.exports = bookshelf;
-//var bookshelf = require('../config/bookshelf');
\ No newline at end of file
+//var bookshelf = require('../config/bookshelf');
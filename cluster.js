@@ -0,0 +1,96 @@
+/**
+ * Runs the server on every core: the primary process applies the migrations once,
+ * then forks WORKERS copies of server.js that share the port.
+ *
+ * SIGTERM or SIGINT: the workers finish their requests in flight, then everything exits.
+ * SIGHUP: rolling restart, a new worker is started and listening before an old one is stopped.
+ */
+"use strict";
+let cluster = require('cluster');
+let os = require('os');
+let dotenv = require('dotenv');
+
+dotenv.load();
+cluster.setupMaster({exec: __dirname + '/server.js'});
+
+let broadcast = require('./lib/broadcast');
+require('./lib/rateLimit'); //the primary keeps the rate limit buckets of all the workers
+
+//config defaults
+let workerCount = parseInt(process.env.WORKERS) || os.cpus().length;
+let restartDelay = 1000; //ms before replacing a worker that crashed
+
+let stopping = false;
+let retiring = new Set(); //workers stopped on purpose, they are not replaced
+
+let fork = () => {
+    //one password thread per worker process, the processes already use all the cores
+    return cluster.fork({PASSWORD_WORKERS: process.env.PASSWORD_WORKERS || 1});
+};
+
+let listening = worker => new Promise((resolve, reject) => {
+    worker.once('listening', resolve);
+    worker.once('exit', () => reject(new Error(`Worker ${worker.process.pid} exited before listening`)));
+});
+
+let stop = worker => new Promise(resolve => {
+    if (worker.isDead())
+        return resolve();
+    retiring.add(worker);
+    worker.once('exit', resolve);
+    worker.process.kill('SIGTERM');
+});
+
+cluster.on('exit', (worker, code, signal) => {
+    if (retiring.delete(worker) || stopping)
+        return;
+    console.error(`Worker ${worker.process.pid} died (${signal || code}), starting a new one`);
+    setTimeout(() => {
+        if (!stopping)
+            fork();
+    }, restartDelay);
+});
+
+//one at a time, so the other workers keep serving
+let restarting = false;
+process.on('SIGHUP', () => {
+    if (restarting || stopping)
+        return;
+    restarting = true;
+    console.log('Rolling restart');
+    let workers = Object.keys(cluster.workers).map(id => cluster.workers[id]);
+    workers.reduce((previous, worker) => previous.then(() => {
+        let replacement = fork();
+        return listening(replacement).then(() => stop(worker));
+    }), Promise.resolve())
+        .catch(err => console.error(err))
+        .then(() => {
+            restarting = false;
+            console.log('Rolling restart done');
+        });
+});
+
+let shutdown = () => {
+    if (stopping)
+        return;
+    stopping = true;
+    let workers = Object.keys(cluster.workers).map(id => cluster.workers[id]);
+    Promise.all(workers.map(stop)).then(() => process.exit(0));
+};
+process.on('SIGTERM', shutdown);
+process.on('SIGINT', shutdown);
+
+broadcast.relay();
+
+let knex = require('./db');
+knex.migrate.latest()
+    .then(() => knex.destroy())
+    .then(() => {
+        console.log(`Starting ${workerCount} workers`);
+        for (let i = 0; i < workerCount; i++)
+            fork();
+    })
+    .catch(err => {
+        console.error(err);
+        process.exit(1);
+    });
@@ -2,27 +2,48 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
+let bookshelf = require('../bookshelf');
 let Game = require('../models/Game');
+let conditional = require('../lib/conditional');
+let fields = require('../lib/fields');
+let pagination = require('../lib/pagination');
+let responseCache = require('../lib/responseCache');
+let search = require('../lib/search');
+let streaming = require('../lib/streaming');
 
 exports.list = (req, res, next)=>{
-    //order
-    let order = req.query.order || 'created_at';
-    let orderType = req.query.order_type;
-    if(orderType!='desc')
-        orderType = 'asc';
-
     //filters
-    let search = req.query.search || '%';
+    let terms = search.terms(req.query.search);
+
+    //order and page, the most relevant first when searching
+    let page = terms.length ? pagination.parse(req, Game.sortable.concat('search_rank'), 'search_rank', 'desc') :
+        pagination.parse(req, Game.sortable);
+    if(page.errors)
+        return res.status(422).send(page.errors);
+    let selected = fields.parse(req, Game.fields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let serialize = game=>fields.serialize(game, selected.fields);
+
+    let filter = wb=>{
+        if(terms.length)
+            search.apply(wb, 'games', terms);
+        return wb;
+    };
+    let columns = (fields.columns(selected, Game.fields, pagination.columns(page)) || Game.metadataColumns)
+        .map(column=>'games.' + column);
+
+    //the same URL is sent as JSON or NDJSON, caches in front of the API must key on Accept
+    res.vary('Accept');
+    if(streaming.requested(req))
+        return streaming.send(res, ()=>filter(bookshelf.knex('games').column(columns)), page, 'games',
+            row=>serialize(Game.forge(row)));
 
     //retrieve
     return Game.forge()
-        .query(wb=>
-            wb.where('name', 'LIKE', search)
-            .orWhere('json_designers', 'LIKE', search)
-        )
-        .orderBy(order, orderType)
-        .fetchAll()
-        .then(data=>res.send(data.toJSON()))
+        .query(wb=>pagination.apply(filter(wb), page, 'games'))
+        .fetchAll({columns: columns})
+        .then(data=>res.send(pagination.paginate(req, res, data, page).map(serialize)))
         .catch(err=>{
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
@@ -30,11 +51,47 @@ exports.list = (req, res, next)=>{
 };
 
 exports.get = (req, res, next)=>{
-    return new Game({id: req.params.id}).fetch()
+    let selected = fields.parse(req, Game.fields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let columns = fields.columns(selected, Game.fields, ['id', 'updated_at']) || Game.metadataColumns;
+
+    return new Game({id: req.params.id}).fetch({columns: columns})
+        .then(data=>{
+            if(!data)
+                return res.status(404).send({msg: "Game not found"});
+            if(conditional.fresh(req, res, conditional.entity(data)))
+                return res.status(304).end();
+            res.send(fields.serialize(data, selected.fields))
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
+        })
+};
+
+exports.cover = (req, res, next)=>{
+    let fresh = etag=>{
+        res.set({'ETag': etag, 'Cache-Control': 'public, no-cache'});
+        return req.fresh;
+    };
+    //the stored ETag answers the clients that have a copy without reading the cover
+    return new Game({id: req.params.id}).fetch({columns: ['id', 'cover_etag']})
         .then(data=>{
             if(!data)
                 return res.status(404).send({msg: "Game not found"});
-            res.send(data.toJSON())
+            let etag = data.get('cover_etag');
+            if(etag && fresh(etag))
+                return res.status(304).end();
+            return new Game({id: req.params.id}).fetch({columns: ['id', 'cover']}).then(data=>{
+                let cover = (data && data.get('cover')) || '';
+                //games inserted outside the API may have no stored ETag
+                if(!etag && fresh(conditional.digest(cover)))
+                    return res.status(304).end();
+                let image = Game.decodeCover(cover);
+                res.set('X-Content-Type-Options', 'nosniff');
+                res.type(image.type).send(image.data);
+            });
         })
         .catch(err=>{
             console.error(err);
@@ -61,7 +118,7 @@ exports.post = (req, res, next)=>{
         designers: req.body.designers,
         cover: req.body.cover
     }).save()
-        .then(data=>res.status(201).send(data.toJSON()))
+        .then(data=>responseCache.invalidate('games').then(()=>res.status(201).send(data.toJSON())))
         .catch((err) => {
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
@@ -2,49 +2,135 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
-let User = require('../models/User');
 let Game = require('../models/Game');
 let Play = require('../models/Play');
+let bookshelf = require('../bookshelf');
+let auth = require('../lib/auth');
+let conditional = require('../lib/conditional');
+let fields = require('../lib/fields');
+let pagination = require('../lib/pagination');
+let responseCache = require('../lib/responseCache');
+let search = require('../lib/search');
+let stats = require('../lib/stats');
+let streaming = require('../lib/streaming');
 
 exports.userMiddleware = (req, res, next) => {
-    return new User({id: req.params.userId}).fetch().then((user)=>{
+    //the owner is often the authenticated user, otherwise it comes from the same cache
+    let owner = req.user && req.user.id == req.params.userId ? Promise.resolve(req.user) : auth.loadUser(req.params.userId);
+    return owner.then((user)=>{
         if(!user)
             return res.status(404).send({ msg: 'Wrong user id' });
         req.owner = user;
         next();
-    }).catch(()=>{
+    }).catch((err)=>{
         console.error(err);
         res.status(500).send({msg: "Internal server Error"});
     });
 };
 
 
+//moves the game name selected by ?include=game into a game object
+function withGame(json, play) {
+    delete json.game_name;
+    json.game = {id: play.get('game_id'), name: play.get('game_name')};
+    return json;
+}
+
+let isInt = value => /^[-+]?\d+$/.test(String(value));
+let notEmpty = value => value !== undefined && value !== null && String(value).length > 0;
+
+//list filters, integers like the played_at and game_id of a new play
+let filterParameters = {from_date: 'From_date', to_date: 'To_date', game: 'Game'};
+
+/**
+ * Reads the filters of list from the query string.
+ * Returns {from, to, game} (undefined when missing or empty) or {errors} in the 422 format.
+ */
+function parseFilters(req) {
+    let errors = Object.keys(filterParameters)
+        .filter(param=>notEmpty(req.query[param]) && !isInt(req.query[param]))
+        .map(param=>({param: param, msg: filterParameters[param] + ' must be an integer', value: req.query[param]}));
+    if(errors.length)
+        return {errors: errors};
+    let value = param=>notEmpty(req.query[param]) ? parseInt(req.query[param]) : undefined;
+    return {from: value('from_date'), to: value('to_date'), game: value('game')};
+}
+
+/**
+ * Query of the plays of a user for list: columns, game join and filters, without ordering and page.
+ * explain.js checks the plans of these queries.
+ * @param options.columns, options.includeGame, options.terms (search), options.filters from parseFilters
+ */
+exports.listQuery = (query, userId, options)=>{
+    query.select(options.columns).where('plays.user_id', userId);
+    if(options.includeGame)
+        query.leftJoin('games', 'games.id', 'plays.game_id').select('games.name as game_name');
+
+    // Filtering
+    let filters = options.filters || {};
+    if(options.terms && options.terms.length)
+        search.apply(query, 'plays', options.terms);
+    if(filters.from !== undefined)
+        query.where('plays.played_at', '>=', filters.from);
+    if(filters.to !== undefined)
+        query.where('plays.played_at', '<=', filters.to);
+    if(filters.game !== undefined)
+        query.where('plays.game_id', filters.game);
+    return query;
+};
+
 exports.list = (req, res, next)=>{
-    //retrieve
-    return req.owner.fetch({withRelated:[
-        { plays: function(query) {
-            // Filtering
-            if(req.query.search)
-                query = query.where(function(){
-                    this.where('name', 'LIKE', search).orWhere('json_additional_data', 'LIKE', search)
-                });
-            if(req.query.from_date)
-                query = query.where('played_at', '>=', req.query.from_date);
-            if(req.query.to_date)
-                query = query.where('played_at', '<=', req.query.to_date);
-            if(req.query.game)
-                query = query.where('game_id', 'LIKE', req.query.game);
-
-            // Ordering
-            let order = req.query.order || 'created_at';
-            let orderType = req.query.order_type;
-            if(orderType!='desc')
-                orderType = 'asc';
-            query = query.orderBy(order, orderType);
-            return query;
-        }}
-        ]})
-        .then(data=>res.send(data.related('plays').toJSON()))
+    //order and page, the most relevant first when searching
+    let terms = search.terms(req.query.search);
+    let page = terms.length ? pagination.parse(req, Play.sortable.concat('search_rank'), 'search_rank', 'desc') :
+        pagination.parse(req, Play.sortable);
+    if(page.errors)
+        return res.status(422).send(page.errors);
+    let filters = parseFilters(req);
+    if(filters.errors)
+        return res.status(422).send(filters.errors);
+    let include = (req.query.include || '').split(',').indexOf('game') >= 0;
+    let playFields = include ? Object.assign({game: ['game_id']}, Play.fields) : Play.fields;
+    let selected = fields.parse(req, playFields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let includeGame = include && fields.includes(selected, 'game');
+    let serialize = play=>{
+        let json = fields.serialize(play, selected.fields);
+        return includeGame ? withGame(json, play) : json;
+    };
+    //updated_at for the validators of the page
+    let columns = (fields.columns(selected, playFields, pagination.columns(page).concat('updated_at')) || ['*'])
+        .map(column=>'plays.' + column);
+
+    let filter = query=>exports.listQuery(query, req.owner.id,
+        {columns: columns, includeGame: includeGame, terms: terms, filters: filters});
+    let knex = bookshelf.knex;
+
+    //the same URL is sent as JSON or NDJSON, caches in front of the API must key on Accept
+    res.vary('Accept');
+    if(streaming.requested(req))
+        return streaming.send(res, ()=>filter(knex('plays')), page, 'plays', row=>serialize(Play.forge(row)));
+
+    //retrieve, with a single query also when games are included
+    let send = ()=>Play.forge()
+        .query(query=>pagination.apply(filter(query), page, 'plays'))
+        .fetchAll()
+        .then(data=>{
+            //the validators cover the extra row fetched by pagination, it decides the next link
+            let updated = data.map(play=>new Date(play.get('updated_at')).getTime());
+            conditional.fresh(req, res, conditional.collection(req, data.length, data.length ? Math.max.apply(null, updated) : null));
+            res.send(pagination.paginate(req, res, data, page).map(serialize));
+        });
+
+    //a client that has a copy is answered from count and max(updated_at) of the same rows
+    let check = !conditional.isConditional(req) ? Promise.resolve(false) :
+        knex.from(pagination.apply(filter(knex('plays')), page, 'plays').as('page'))
+            .first(knex.raw('count(*) as count'), knex.raw('max(updated_at) as updated_at'))
+            .then(row=>conditional.fresh(req, res, conditional.collection(req, row.count, row.updated_at)));
+
+    return check
+        .then(fresh=>fresh ? res.status(304).end() : send())
         .catch(err=>{
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
@@ -52,13 +138,20 @@ exports.list = (req, res, next)=>{
 };
 
 exports.get = (req, res, next)=>{
-    return new Play({id: req.params.id}).fetch()
+    let selected = fields.parse(req, Play.fields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let columns = fields.columns(selected, Play.fields, ['id', 'user_id', 'updated_at']);
+
+    return new Play({id: req.params.id}).fetch(columns ? {columns: columns} : {})
         .then(data=>{
             if(!data)
                 return res.status(404).send({msg: "Play not found"});
             if(data.get('user_id') != req.owner.id)
                 return res.status(403).send({msg: "Play is not of this user"});
-            res.send(data.toJSON())
+            if(conditional.fresh(req, res, conditional.entity(data)))
+                return res.status(304).end();
+            res.send(fields.serialize(data, selected.fields))
         })
         .catch(err=>{
             console.error(err);
@@ -81,7 +174,7 @@ exports.post = (req, res, next)=>{
         return res.status(422).send(errors);
     }
 
-    return new Game({id: req.body.game_id}).fetch()
+    return new Game({id: req.body.game_id}).fetch({columns: ['id']})
         .then(data=>{
             if(!data)
                 return res.status(422).send([
@@ -90,12 +183,131 @@ exports.post = (req, res, next)=>{
                         "msg": "Game_id inserted doesn't exist"
                     }
                 ]);
-            return req.owner.plays().create({
-                name: req.body.name,
-                additional_data: req.body.additional_data,
-                played_at: req.body.played_at,
-                game_id: req.body.game_id,
-            }).then(data=>res.status(201).send(data.toJSON()));
+            return bookshelf.transaction(t=>
+                req.owner.plays().create({
+                    name: req.body.name,
+                    additional_data: req.body.additional_data,
+                    played_at: req.body.played_at,
+                    game_id: req.body.game_id,
+                }, {transacting: t}).then(play=>stats.record(t, [{
+                    user_id: req.owner.id,
+                    game_id: req.body.game_id,
+                    played_at: req.body.played_at,
+                    additional_data: req.body.additional_data
+                }]).then(()=>play))
+            ).then(data=>responseCache.invalidate('user:' + req.owner.id)
+                .then(()=>res.status(201).send(data.toJSON())));
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
+        });
+};
+
+//rows per INSERT statement, sqlite accepts at most 999 bound variables per statement
+let bulkChunkSize = parseInt(process.env.BULK_CHUNK_SIZE) || 100;
+
+function chunks(list, size) {
+    let result = [];
+    for (let i = 0; i < list.length; i += size)
+        result.push(list.slice(i, i + size));
+    return result;
+}
+
+/**
+ * Reads the plays of a bulk request, from a JSON array or NDJSON text.
+ * Returns {rows, errors, invalid}, invalid holds the indexes of the rows that are not valid JSON.
+ */
+function parseBulk(body) {
+    let invalid = new Set();
+    if (Array.isArray(body))
+        return {rows: body, errors: [], invalid: invalid};
+    if (typeof body != 'string')
+        return {rows: [], errors: [{param: 'body', msg: 'Body must be a JSON array or NDJSON'}], invalid: invalid};
+
+    let rows = [];
+    let errors = [];
+    body.split('\n').forEach(line=>{
+        if (!line.trim())
+            return;
+        try {
+            rows.push(JSON.parse(line));
+        } catch (e) {
+            errors.push({row: rows.length, param: 'body', msg: 'Row is not valid JSON'});
+            invalid.add(rows.length);
+            rows.push(null);
+        }
+    });
+    return {rows: rows, errors: errors, invalid: invalid};
+}
+
+/**
+ * Same checks as post, for one row of a bulk request.
+ */
+function validatePlay(row, i) {
+    if (!row || typeof row != 'object')
+        return [{row: i, param: 'body', msg: 'Row must be an object'}];
+    let errors = [];
+    if (!notEmpty(row.name))
+        errors.push({row: i, param: 'name', msg: 'Name cannot be blank', value: row.name});
+    if (!notEmpty(row.additional_data))
+        errors.push({row: i, param: 'additional_data', msg: 'Additional_data cannot be blank', value: row.additional_data});
+    if (!isInt(row.played_at))
+        errors.push({row: i, param: 'played_at', msg: 'Played_at cannot be blank', value: row.played_at});
+    if (!isInt(row.game_id))
+        errors.push({row: i, param: 'game_id', msg: 'Game_id must be an integer', value: row.game_id});
+    return errors;
+}
+
+exports.bulk = (req, res, next)=>{
+    if (req.user.get('role') != 'power' && req.user.get('id') != req.params.userId)
+        return res.status(403).send({msg: "You are not authorized to create plays"});
+
+    let parsed = parseBulk(req.body);
+    let rows = parsed.rows;
+    let errors = parsed.errors;
+    rows.forEach((row, i)=>{
+        if (!parsed.invalid.has(i))
+            errors = errors.concat(validatePlay(row, i));
+    });
+    if (!errors.length && !rows.length)
+        errors.push({param: 'body', msg: 'No plays to import'});
+    if (errors.length)
+        return res.status(422).send(errors);
+
+    let knex = bookshelf.knex;
+    let gameIds = Array.from(new Set(rows.map(row=>parseInt(row.game_id))));
+
+    //one set query for all the referenced games
+    return Promise.all(chunks(gameIds, 500).map(ids=>knex('games').whereIn('id', ids).pluck('id')))
+        .then(found=>{
+            let existing = new Set([].concat.apply([], found).map(id=>parseInt(id)));
+            rows.forEach((row, i)=>{
+                if (!existing.has(parseInt(row.game_id)))
+                    errors.push({row: i, param: 'game_id', msg: "Game_id inserted doesn't exist", value: row.game_id});
+            });
+            if (errors.length)
+                return res.status(422).send(errors);
+
+            let now = new Date();
+            let records = rows.map(row=>({
+                user_id: req.owner.id,
+                game_id: row.game_id,
+                name: row.name,
+                played_at: row.played_at,
+                json_additional_data: JSON.stringify(row.additional_data),
+                created_at: now,
+                updated_at: now
+            }));
+            return bookshelf.transaction(trx=>
+                chunks(records, bulkChunkSize).reduce(
+                    (previous, chunk)=>previous.then(()=>trx('plays').insert(chunk)),
+                    Promise.resolve()
+                ).then(()=>stats.record(trx, records))
+            ).then(()=>responseCache.invalidate('user:' + req.owner.id)).then(()=>res.status(201).send({
+                count: records.length,
+                links: {plays: '/users/' + req.owner.id + '/plays'}
+            }));
         })
         .catch(err=>{
             console.error(err);
@@ -0,0 +1,42 @@
+/**
+ * Play statistics, read from the play_stats summary table.
+ */
+"use strict";
+let bookshelf = require('../bookshelf');
+let Game = require('../models/Game');
+let stats = require('../lib/stats');
+
+//needs play.userMiddleware
+exports.user = (req, res, next)=>{
+    return stats.forUser(bookshelf.knex, req.owner.id)
+        .then(data=>{
+            data.links = {
+                'self': '/users/' + req.owner.id + '/stats',
+                'user': '/users/' + req.owner.id,
+            };
+            res.send(data);
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
+        })
+};
+
+exports.game = (req, res, next)=>{
+    return new Game({id: req.params.id}).fetch({columns: ['id']})
+        .then(game=>{
+            if(!game)
+                return res.status(404).send({msg: "Game not found"});
+            return stats.forGame(bookshelf.knex, game.id).then(data=>{
+                data.links = {
+                    'self': '/games/' + game.id + '/stats',
+                    'game': '/games/' + game.id,
+                };
+                res.send(data);
+            });
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
+        })
+};
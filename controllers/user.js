@@ -2,7 +2,16 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
+let bookshelf = require('../bookshelf');
 let User = require('../models/User');
+let passwords = require('../lib/passwords');
+let pagination = require('../lib/pagination');
+let streaming = require('../lib/streaming');
+let auth = require('../lib/auth');
+let conditional = require('../lib/conditional');
+let fields = require('../lib/fields');
+let responseCache = require('../lib/responseCache');
+let stats = require('../lib/stats');
 let moment = require('moment');
 var jwt = require('jsonwebtoken');
 
@@ -17,24 +26,33 @@ function generateToken(user) {
 }
 
 exports.list = (req, res, next)=>{
-    //order
-    let order = req.query.order || 'created_at';
-    let orderType = req.query.order_type;
-    if(orderType!='desc')
-        orderType = 'asc';
+    //order and page
+    let page = pagination.parse(req, User.sortable);
+    if(page.errors)
+        return res.status(422).send(page.errors);
+    let selected = fields.parse(req, User.fields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let serialize = user=>fields.serialize(user, selected.fields);
+    let columns = (fields.columns(selected, User.fields, pagination.columns(page)) || ['*']).map(column=>'users.' + column);
 
     //filters
     let search = req.query.search || '%';
+    let filter = wb=>wb.where(function(){
+        this.where('name', 'LIKE', search).orWhere('email', 'LIKE', search)
+    });
+
+    //the same URL is sent as JSON or NDJSON, caches in front of the API must key on Accept
+    res.vary('Accept');
+    if(streaming.requested(req))
+        return streaming.send(res, ()=>filter(bookshelf.knex('users').select(columns)), page, 'users',
+            row=>serialize(User.forge(row)));
 
     //retrieve
     return User.forge()
-        .query(wb=>
-            wb.where('name', 'LIKE', search)
-            .orWhere('email', 'LIKE', search)
-        )
-        .orderBy(order, orderType)
-        .fetchAll()
-        .then(data=>res.send(data.toJSON()))
+        .query(wb=>pagination.apply(filter(wb), page, 'users'))
+        .fetchAll({columns: columns})
+        .then(data=>res.send(pagination.paginate(req, res, data, page).map(serialize)))
         .catch(err=>{
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
@@ -42,11 +60,18 @@ exports.list = (req, res, next)=>{
 };
 
 exports.get = (req, res, next)=>{
-    return new User({id: req.params.id}).fetch()
+    let selected = fields.parse(req, User.fields);
+    if(selected.errors)
+        return res.status(422).send(selected.errors);
+    let columns = fields.columns(selected, User.fields, ['id', 'updated_at']);
+
+    return new User({id: req.params.id}).fetch(columns ? {columns: columns} : {})
         .then(data=>{
             if(!data)
                 return res.status(404).send({msg: "User not found"});
-            res.send(data.toJSON());
+            if(conditional.fresh(req, res, conditional.entity(data)))
+                return res.status(304).end();
+            res.send(fields.serialize(data, selected.fields));
         })
         .catch(err=>{
             console.error(err);
@@ -77,6 +102,9 @@ exports.post = (req, res, next)=>{
             if (err.code === 'ER_DUP_ENTRY' || err.code == '23505' || err.code == 'SQLITE_CONSTRAINT') {
                 return res.status(422).send({ msg: 'The name/email you have entered is already associated with another account.' });
             }
+            if (err.code == 'EQUEUEFULL') {
+                return res.status(503).send({ msg: 'Server busy, retry later' });
+            }
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
         });
@@ -121,13 +149,44 @@ exports.put = (req, res, next)=>{
     if (role)
         dataToSet.role = role;
 
+    let modified = ()=>res.status(412).send({msg: "User has been modified since it was read"});
+    let ifMatch = req.get('If-Match');
+
     return new User({id: req.params.id}).fetch()
         .then(data=>{
             if(!data)
                 return res.status(404).send({msg: "User not found"});
-            return data.save(dataToSet).then(data=>res.send(data.toJSON()))
+            let validators = conditional.entity(data);
+            if(!conditional.matches(req, validators))
+                return modified();
+            return passwords.hash(dataToSet.password).then(hash=>{
+                //always later than the read version, so the new ETag differs even within the same millisecond
+                let changes = Object.assign({}, dataToSet, {
+                    password: hash,
+                    updated_at: new Date(Math.max(Date.now(), (validators.lastModified || 0) + 1))
+                });
+                //the If-Match check is repeated by the UPDATE: of two concurrent writes with the same ETag one gets 412
+                let update = bookshelf.knex('users').where('id', data.id);
+                if(ifMatch && ifMatch.trim() != '*')
+                    update.where('updated_at', data.get('updated_at'));
+                return update.update(changes).then(count=>{
+                    if(!count)
+                        return modified();
+                    data.set(changes);
+                    return Promise.all([
+                        auth.invalidateUser(data.id),
+                        responseCache.invalidate('user:' + data.id)
+                    ]).then(()=>{
+                        res.set('ETag', conditional.entity(data).etag);
+                        res.send(data.toJSON());
+                    });
+                });
+            });
         })
         .catch((err) => {
+            if (err.code == 'EQUEUEFULL') {
+                return res.status(503).send({ msg: 'Server busy, retry later' });
+            }
             console.error(err);
             res.status(500).send({msg: "Internal server Error"});
         });
@@ -141,7 +200,13 @@ exports.delete = (req, res, next)=>{
         .then(data=>{
             if(!data)
                 return res.status(404).send({msg: "User not found"});
-            return data.destroy().then(res.send(data.toJSON()));
+            let json = data.toJSON();
+            return bookshelf.transaction(t=>
+                stats.removeUser(t, data.id).then(()=>data.destroy({transacting: t}))
+            ).then(()=>Promise.all([
+                auth.invalidateUser(req.params.id),
+                responseCache.invalidate('user:' + req.params.id)
+            ])).then(()=>res.send(json));
         })
         .catch(err=>{
             console.error(err);
@@ -169,10 +234,26 @@ exports.login = (req, res, next) => {
                 return errorMex();
             }
             user.comparePassword(req.body.password, (err, isMatch) => {
+                if (err && err.code == 'EQUEUEFULL') {
+                    return res.status(503).send({ msg: 'Server busy, retry later' });
+                }
                 if (!isMatch) {
                     return errorMex();
                 }
-                return res.send({ token: generateToken(user), user: user.toJSON()});
+                res.send({ token: generateToken(user), user: user.toJSON()});
+                //the cost factor changed: store a new hash while we know the password
+                if (user.needsRehash()) {
+                    user.save({password: req.body.password}, {patch: true})
+                        .then(()=>Promise.all([
+                            auth.invalidateUser(user.id),
+                            responseCache.invalidate('user:' + user.id)
+                        ]))
+                        .catch(err=>console.error(err));
+                }
             });
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
         });
 };
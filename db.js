@@ -0,0 +1,8 @@
+/**
+ * The knex instance, and its connection pool, shared by the whole process.
+ * Migrations are not run here: use `npm run migrate`.
+ */
+"use strict";
+let config = require('./knexfile');
+
+module.exports = require('knex')(config);
@@ -0,0 +1,58 @@
+/**
+ * Prints, as JSON, the query plans of the main play list queries built by controllers/play.js:
+ * {client, queries: {name: {plan, fullScan, sort}}}. fullScan is true when the plays table is
+ * read whole, sort when the rows are sorted instead of being read in index order (sqlite only).
+ * Used by the tests. Usage: node explain.js
+ */
+"use strict";
+let knex = require('./db');
+let pagination = require('./lib/pagination');
+let play = require('./controllers/play');
+
+let client = knex.client.config.client;
+let userId = 1;
+let page = (order, orderType, after) => ({order: order, orderType: orderType || 'asc', limit: 25, after: after || null});
+let columns = ['plays.*'];
+
+let queries = {
+    'by created_at': [{}, page('created_at')],
+    'by played_at': [{}, page('played_at', 'desc')],
+    'next page by played_at': [{}, page('played_at', 'desc', {value: 0, id: 1})],
+    'date range by played_at': [{filters: {from: 0, to: 1000}}, page('played_at')],
+    'game by played_at': [{filters: {game: 1}}, page('played_at', 'desc')],
+    'by game_id': [{}, page('game_id', 'desc')],
+    'next page by game_id': [{}, page('game_id', 'desc', {value: 1, id: 1})],
+    'with games by created_at': [{includeGame: true}, page('created_at')],
+};
+
+function explain(trx, query) {
+    let sql = query.toSQL();
+    if (client == 'pg')
+        return trx.raw('EXPLAIN ' + sql.sql, sql.bindings).then(result => result.rows.map(row => row['QUERY PLAN']));
+    return trx.raw('EXPLAIN QUERY PLAN ' + sql.sql, sql.bindings).then(rows => rows.map(row => row.detail));
+}
+
+let analyze = plan => ({
+    plan: plan,
+    fullScan: plan.some(line => /^SCAN (TABLE )?plays\b/.test(line) || /Seq Scan on plays\b/.test(line)),
+    sort: plan.some(line => /USE TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY/.test(line))
+});
+
+//postgres reads small tables sequentially anyway, the plan must show it can use an index
+knex.transaction(trx => (client == 'pg' ? trx.raw('SET LOCAL enable_seqscan = off') : Promise.resolve())
+    .then(() => Promise.all(Object.keys(queries).map(name => {
+        let options = Object.assign({columns: columns}, queries[name][0]);
+        let query = pagination.apply(play.listQuery(trx('plays'), userId, options), queries[name][1], 'plays');
+        return explain(trx, query).then(plan => [name, analyze(plan)]);
+    })))
+    .then(results => {
+        let output = {client: client, queries: {}};
+        results.forEach(result => output.queries[result[0]] = result[1]);
+        console.log(JSON.stringify(output, null, 2));
+    }))
+    .catch(err => {
+        console.error(err);
+        process.exitCode = 1;
+    })
+    .then(() => knex.destroy())
+    .then(() => process.exit());
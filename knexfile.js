@@ -7,19 +7,46 @@ let pg = require('pg');
 
 dotenv.load();
 
+//config defaults
+let acquireTimeout = parseInt(process.env.DB_ACQUIRE_TIMEOUT) || 10000; //ms to wait for a free connection
+let statementTimeout = parseInt(process.env.DB_STATEMENT_TIMEOUT) || 30000; //ms, postgres only
+let busyTimeout = parseInt(process.env.SQLITE_BUSY_TIMEOUT) || 5000; //ms to wait for a locked sqlite database
 
 pg.defaults.ssl = true;
 if(process.env.DATABASE_URL){
     module.exports = {
         client: 'pg',
-        connection: process.env.DATABASE_URL+'?ssl=true'
+        connection: process.env.DATABASE_URL+'?ssl=true',
+        pool: {
+            min: parseInt(process.env.DB_POOL_MIN) || 2,
+            max: parseInt(process.env.DB_POOL_MAX) || 10,
+            afterCreate: (conn, done) => {
+                conn.query('SET statement_timeout = ' + statementTimeout, err => done(err, conn));
+            }
+        },
+        acquireConnectionTimeout: acquireTimeout
     };
+}else if(process.env.NODE_ENV == 'production'){
+    throw new Error('DATABASE_URL must be set in production, sqlite is for development only');
 }else {
     module.exports = {
         client: 'sqlite',
         connection: {
-            filename: './dev.sqlite3'
+            filename: process.env.SQLITE_FILENAME || './dev.sqlite3'
+        },
+        useNullAsDefault: true,
+        pool: {
+            min: 1,
+            max: 1, //sqlite has a single writer, one connection avoids lock contention inside the process
+            afterCreate: (conn, done) => {
+                //WAL lets readers work during writes, busy_timeout waits for locks instead of failing with SQLITE_BUSY
+                conn.run('PRAGMA journal_mode = WAL', err => {
+                    if (err)
+                        return done(err, conn);
+                    conn.run('PRAGMA busy_timeout = ' + busyTimeout, err => done(err, conn));
+                });
+            }
         },
-        useNullAsDefault: true
+        acquireConnectionTimeout: acquireTimeout
     };
 }
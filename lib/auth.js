@@ -0,0 +1,88 @@
+/**
+ * Token verification and authenticated user loading, both cached.
+ *
+ * Verified tokens are cached until they expire (at most AUTH_CACHE_TTL seconds),
+ * user rows for AUTH_CACHE_TTL seconds; the user controller evicts a row when it
+ * modifies or deletes that user, so a deleted user's token stops working immediately.
+ */
+"use strict";
+let jwt = require('jsonwebtoken');
+let broadcast = require('./broadcast');
+let LRU = require('./lru');
+let metrics = require('./metrics');
+let User = require('../models/User');
+
+//config defaults
+let size = parseInt(process.env.AUTH_CACHE_SIZE) || 10000;
+let ttl = (parseInt(process.env.AUTH_CACHE_TTL) || 60) * 1000;
+
+let tokens = new LRU({max: size, ttl: ttl});
+let users = new LRU({max: size, ttl: ttl});
+//incremented at every eviction, a row fetched meanwhile may be stale and is not stored
+let generation = 0;
+
+new metrics.Gauge('auth_cache_lookups', 'Lookups in the authentication caches', ['cache', 'result'], () => {
+    let t = tokens.stats();
+    let u = users.stats();
+    return [[['tokens', 'hit'], t.hits], [['tokens', 'miss'], t.misses], [['users', 'hit'], u.hits], [['users', 'miss'], u.misses]];
+});
+
+/**
+ * Returns the payload of a valid token, false otherwise.
+ */
+exports.verifyToken = (token) => {
+    if (!token)
+        return false;
+    let payload = tokens.get(token);
+    if (payload)
+        return payload;
+    try {
+        payload = jwt.verify(token, process.env.TOKEN_SECRET);
+    } catch (err) {
+        return false;
+    }
+    let expiresIn = payload.exp ? payload.exp * 1000 - Date.now() : ttl;
+    tokens.set(token, payload, Math.min(ttl, expiresIn));
+    return payload;
+};
+
+/**
+ * Resolves to a User model for the given id, or null if it doesn't exist.
+ * Every call returns a new model built from the cached row.
+ */
+exports.loadUser = (id) => {
+    let attributes = users.get(String(id));
+    if (attributes)
+        return Promise.resolve(User.forge(attributes));
+    let started = generation;
+    return new User({id: id}).fetch().then(user => {
+        if (user && started == generation)
+            users.set(String(id), Object.assign({}, user.attributes));
+        return user;
+    });
+};
+
+//the other worker processes of cluster.js evict the same rows
+broadcast.subscribe('auth:invalidateUser', id => {
+    generation++;
+    users.delete(String(id));
+});
+broadcast.subscribe('auth:clear', () => {
+    generation++;
+    tokens.clear();
+    users.clear();
+});
+
+/**
+ * Evicts a user in every worker process; resolves when they all did, the change can then be acknowledged.
+ */
+exports.invalidateUser = (id) => broadcast.publish('auth:invalidateUser', id);
+
+exports.clear = () => broadcast.publish('auth:clear');
+
+exports.stats = () => {
+    return {
+        tokens: tokens.stats(),
+        users: users.stats()
+    };
+};
@@ -0,0 +1,183 @@
+/**
+ * Messages between the worker processes started by cluster.js, relayed by the primary.
+ *
+ * publish() runs the handlers of a channel in this process and in all the other
+ * workers, and resolves when all of them are done, so in-process caches can be invalidated
+ * everywhere before a response tells a client about the change. gather() asks every
+ * worker for a value, e.g. its metrics. request() asks the primary, for state that
+ * must be shared by all the workers. Outside of cluster.js they are all local calls.
+ */
+"use strict";
+let cluster = require('cluster');
+
+//config defaults
+let gatherTimeout = parseInt(process.env.GATHER_TIMEOUT) || 1000; //ms to wait for the replies of the workers
+
+let prefix = 'board-rest:';
+let handlers = new Map(); //channel -> [handler]
+let responders = new Map(); //channel -> function returning a value or a promise
+let servers = new Map(); //channel -> function answering request(), in the primary
+let pending = new Map(); //id of a gather() or request() -> callback of its answer
+let nextId = 0;
+
+let clustered = () => cluster.isWorker && process.connected;
+
+function runHandlers(channel, data) {
+    return Promise.all((handlers.get(channel) || []).map(handler => handler(data)));
+}
+
+function respond(channel) {
+    let responder = responders.get(channel);
+    return Promise.resolve(responder ? responder() : null);
+}
+
+/**
+ * Runs handler(data) for every message published on the channel, by any worker.
+ */
+exports.subscribe = (channel, handler) => {
+    if (!handlers.has(channel))
+        handlers.set(channel, []);
+    handlers.get(channel).push(handler);
+};
+
+/**
+ * Runs the handlers of the channel here and in the other workers, resolving when they are all done.
+ * Workers that don't acknowledge within GATHER_TIMEOUT are not waited for.
+ */
+exports.publish = (channel, data) => {
+    let local = runHandlers(channel, data);
+    if (!clustered())
+        return local;
+    let id = nextId++;
+    let remote = new Promise(resolve => {
+        pending.set(id, resolve);
+        process.send({type: prefix + 'publish', channel: channel, data: data, id: id});
+    });
+    return Promise.all([local, remote]);
+};
+
+/**
+ * Sets the function that answers gather() on the channel.
+ */
+exports.respond = (channel, responder) => {
+    responders.set(channel, responder);
+};
+
+/**
+ * Resolves to the answers of all the workers to the channel, this one included.
+ * Workers that don't answer within GATHER_TIMEOUT are left out.
+ */
+exports.gather = (channel) => {
+    if (!clustered())
+        return respond(channel).then(value => [value]);
+    let id = nextId++;
+    return new Promise(resolve => {
+        pending.set(id, resolve);
+        process.send({type: prefix + 'gather', channel: channel, id: id});
+    });
+};
+
+/**
+ * Sets the function that answers request(data) on the channel; it runs in the primary,
+ * or in this process outside of cluster.js, and returns a value or a promise.
+ */
+exports.serve = (channel, server) => {
+    servers.set(channel, server);
+};
+
+function serveLocally(channel, data) {
+    let server = servers.get(channel);
+    return server ? Promise.resolve().then(() => server(data)) : Promise.reject(new Error('Nothing serves ' + channel));
+}
+
+/**
+ * Resolves to the answer of the primary to data on the channel.
+ */
+exports.request = (channel, data) => {
+    if (!clustered())
+        return serveLocally(channel, data);
+    let id = nextId++;
+    return new Promise((resolve, reject) => {
+        pending.set(id, message => message.error ? reject(new Error(message.error)) : resolve(message.value));
+        process.send({type: prefix + 'request', channel: channel, id: id, data: data});
+    });
+};
+
+if (cluster.isWorker) {
+    process.on('message', message => {
+        if (!message || typeof message.type != 'string' || message.type.indexOf(prefix) !== 0)
+            return;
+        let type = message.type.slice(prefix.length);
+        if (type == 'publish')
+            runHandlers(message.channel, message.data)
+                .catch(err => console.error(err))
+                .then(() => process.send({type: prefix + 'reply', id: message.id, value: true}));
+        else if (type == 'collect')
+            respond(message.channel)
+                .then(value => process.send({type: prefix + 'reply', id: message.id, value: value}))
+                .catch(err => {
+                    console.error(err);
+                    process.send({type: prefix + 'reply', id: message.id, value: null});
+                });
+        else if ((type == 'gathered' || type == 'response') && pending.has(message.id)) {
+            pending.get(message.id)(type == 'gathered' ? message.values : message);
+            pending.delete(message.id);
+        }
+    });
+}
+
+/**
+ * Relays the messages of the workers, to be called once in the primary.
+ */
+exports.relay = () => {
+    let gathers = new Map(); //id in the primary -> {id in the requester, requester, values, waiting}
+    let nextGather = 0;
+
+    let finish = (id) => {
+        let gather = gathers.get(id);
+        if (!gather)
+            return;
+        gathers.delete(id);
+        clearTimeout(gather.timer);
+        if (gather.requester.isConnected())
+            gather.requester.send({type: prefix + 'gathered', id: gather.id, values: gather.values.filter(value => value !== null)});
+    };
+
+    //sends message, with a new id, to the workers and answers the requester when all of them replied
+    let collect = (requester, requesterId, workers, message) => {
+        let id = nextGather++;
+        let gather = {id: requesterId, requester: requester, values: [], waiting: workers.length};
+        gather.timer = setTimeout(() => finish(id), gatherTimeout);
+        gathers.set(id, gather);
+        workers.forEach(other => other.send(Object.assign({}, message, {id: id})));
+        if (!workers.length)
+            finish(id);
+    };
+
+    cluster.on('message', (worker, message) => {
+        if (!message || typeof message.type != 'string' || message.type.indexOf(prefix) !== 0)
+            return;
+        let type = message.type.slice(prefix.length);
+        let workers = Object.keys(cluster.workers).map(id => cluster.workers[id]).filter(other => other.isConnected());
+        if (type == 'publish') {
+            collect(worker, message.id, workers.filter(other => other !== worker), message);
+        } else if (type == 'gather') {
+            collect(worker, message.id, workers, {type: prefix + 'collect', channel: message.channel});
+        } else if (type == 'request') {
+            serveLocally(message.channel, message.data).then(
+                value => ({type: prefix + 'response', id: message.id, value: value}),
+                err => ({type: prefix + 'response', id: message.id, error: err.message})
+            ).then(response => {
+                if (worker.isConnected())
+                    worker.send(response);
+            });
+        } else if (type == 'reply') {
+            let gather = gathers.get(message.id);
+            if (!gather)
+                return;
+            gather.values.push(message.value);
+            if (--gather.waiting <= 0)
+                finish(message.id);
+        }
+    });
+};
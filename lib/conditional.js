@@ -0,0 +1,68 @@
+/**
+ * Validators for conditional requests, derived from the updated_at timestamps.
+ *
+ * A resource has the weak ETag W/"id-updated_at"; a collection W/"count-max(updated_at)-url".
+ * fresh() sets ETag and Last-Modified and tells if the client copy is still valid
+ * (If-None-Match / If-Modified-Since), so handlers can answer 304 before building the body.
+ */
+"use strict";
+let crypto = require('crypto');
+
+//sqlite returns milliseconds, postgres Date objects
+let time = value => value === null || value === undefined ? null : new Date(value).getTime();
+
+/**
+ * Validators of a single model.
+ */
+exports.entity = (model) => {
+    let updated = time(model.get('updated_at'));
+    return {
+        etag: 'W/"' + model.id + '-' + (updated || 0).toString(36) + '"',
+        lastModified: updated
+    };
+};
+
+/**
+ * Validators of a collection: the number of rows and the last update, for the requested URL.
+ */
+exports.collection = (req, count, maxUpdatedAt) => {
+    let updated = time(maxUpdatedAt);
+    let url = crypto.createHash('sha1').update(req.originalUrl).digest('hex').substr(0, 16);
+    return {
+        etag: 'W/"' + parseInt(count) + '-' + (updated || 0).toString(36) + '-' + url + '"',
+        lastModified: updated
+    };
+};
+
+/**
+ * Strong ETag of some content, e.g. a game cover; stored with the content when it is written.
+ */
+exports.digest = (content) => '"' + crypto.createHash('sha1').update(content || '').digest('base64') + '"';
+
+/**
+ * True if the request carries a validator to check.
+ */
+exports.isConditional = (req) => !!(req.get('If-None-Match') || req.get('If-Modified-Since'));
+
+/**
+ * Sets the validator headers; true if the client copy is fresh and a 304 can be sent.
+ */
+exports.fresh = (req, res, validators) => {
+    res.set('ETag', validators.etag);
+    if (validators.lastModified)
+        res.set('Last-Modified', new Date(validators.lastModified).toUTCString());
+    return req.fresh;
+};
+
+/**
+ * False if the request has an If-Match header that doesn't match the current validators.
+ * Our ETags are weak, so the opaque tags are compared without the W/ prefix.
+ */
+exports.matches = (req, validators) => {
+    let header = req.get('If-Match');
+    if (!header || header.trim() == '*')
+        return true;
+    let strip = tag => tag.trim().replace(/^W\//, '');
+    let current = strip(validators.etag);
+    return header.split(',').some(tag => strip(tag) == current);
+};
@@ -0,0 +1,63 @@
+/**
+ * Per-request context kept across asynchronous calls, used to account the database
+ * queries run for each request: their number is sent in the X-Query-Count header,
+ * their time and text are used by lib/metrics.js.
+ */
+"use strict";
+let AsyncLocalStorage = require('async_hooks').AsyncLocalStorage;
+//knex and bookshelf use bluebird, its callbacks must keep the context of the code that created them
+require('bluebird').config({asyncHooks: true});
+
+let storage = new AsyncLocalStorage();
+
+//queries kept per request for the slow request log
+let maxLoggedQueries = 50;
+
+exports.middleware = (req, res, next) => {
+    let context = {queries: 0, queryTime: 0, log: []};
+    storage.run(context, () => {
+        let writeHead = res.writeHead;
+        res.writeHead = function() {
+            res.setHeader('X-Query-Count', context.queries);
+            return writeHead.apply(this, arguments);
+        };
+        next();
+    });
+};
+
+/**
+ * Context of the request being served, undefined outside requests.
+ */
+exports.current = () => storage.getStore();
+
+/**
+ * Accounts the queries run by a knex instance to the current request context.
+ */
+exports.watch = (knex) => {
+    let running = new Map(); //in-flight queries by uid
+    let uid = query => query.__knexQueryUid || query.__knexUid;
+    let done = query => {
+        let started = running.get(uid(query));
+        if (!started)
+            return;
+        running.delete(uid(query));
+        let elapsed = process.hrtime(started.at);
+        let ms = elapsed[0] * 1e3 + elapsed[1] / 1e6;
+        started.context.queryTime += ms;
+        if (started.entry)
+            started.entry.ms = ms;
+    };
+
+    knex.on('query', query => {
+        let context = storage.getStore();
+        if (!context)
+            return;
+        context.queries++;
+        let entry = context.log.length < maxLoggedQueries ? {sql: query.sql, ms: null} : null;
+        if (entry)
+            context.log.push(entry);
+        running.set(uid(query), {context: context, entry: entry, at: process.hrtime()});
+    });
+    knex.on('query-response', (response, query) => done(query));
+    knex.on('query-error', (error, query) => done(query));
+};
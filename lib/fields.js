@@ -0,0 +1,54 @@
+/**
+ * Sparse fieldsets: ?fields=id,name,links chooses the fields of the objects sent.
+ *
+ * Every model lists its fields with the columns each one is computed from (Model.fields),
+ * so the controllers read only those columns and the virtuals that were not asked for
+ * are never computed.
+ */
+"use strict";
+
+/**
+ * Reads ?fields= against the fields of a model.
+ * Returns {fields} (null when the parameter is missing: all the fields) or {errors} in the 422 format.
+ */
+exports.parse = (req, fieldColumns) => {
+    if (req.query.fields === undefined)
+        return {fields: null};
+    let fields = String(req.query.fields).split(',').map(field => field.trim()).filter(field => field);
+    let unknown = fields.filter(field => !Object.prototype.hasOwnProperty.call(fieldColumns, field));
+    if (!fields.length || unknown.length)
+        return {errors: [{
+            param: 'fields',
+            msg: 'Fields must be a comma separated list of: ' + Object.keys(fieldColumns).join(', '),
+            value: req.query.fields
+        }]};
+    return {fields: Array.from(new Set(fields))};
+};
+
+/**
+ * True if the field is sent.
+ */
+exports.includes = (selected, field) => !selected.fields || selected.fields.indexOf(field) >= 0;
+
+/**
+ * Columns to read for the selected fields plus the required ones (id, ordering, validators),
+ * null when all the fields are sent.
+ */
+exports.columns = (selected, fieldColumns, required) => {
+    if (!selected.fields)
+        return null;
+    let columns = new Set(required || []);
+    selected.fields.forEach(field => fieldColumns[field].forEach(column => columns.add(column)));
+    return Array.from(columns);
+};
+
+/**
+ * The object to send for a model: toJSON(), or just the selected fields.
+ */
+exports.serialize = (model, fields) => {
+    if (!fields)
+        return model.toJSON();
+    let json = {};
+    fields.forEach(field => json[field] = model.get(field));
+    return json;
+};
@@ -0,0 +1,75 @@
+/**
+ * Bounded in-process LRU cache with per-entry TTL and hit/miss counters.
+ * It can be bounded by number of entries and by total size of the entries.
+ */
+"use strict";
+
+class LRU {
+    /**
+     * @param options.max maximum number of entries
+     * @param options.ttl default time to live in milliseconds
+     * @param options.maxSize maximum total size, with options.sizeOf(value) giving the size of an entry
+     * @param options.onRemove called with (key, value) when an entry is evicted, expires or is deleted
+     */
+    constructor(options) {
+        this.max = options.max || Infinity;
+        this.ttl = options.ttl;
+        this.maxSize = options.maxSize || Infinity;
+        this.sizeOf = options.sizeOf || (() => 0);
+        this.onRemove = options.onRemove || (() => {});
+        this.used = 0; //total size of the entries
+        this.map = new Map(); //Map keeps insertion order, the first key is the least recently used
+        this.hits = 0;
+        this.misses = 0;
+    }
+
+    get(key) {
+        let entry = this.map.get(key);
+        if (!entry || entry.expires <= Date.now()) {
+            if (entry)
+                this.delete(key);
+            this.misses++;
+            return undefined;
+        }
+        //move to the most recently used position
+        this.map.delete(key);
+        this.map.set(key, entry);
+        this.hits++;
+        return entry.value;
+    }
+
+    set(key, value, ttl) {
+        this.delete(key);
+        let size = this.sizeOf(value);
+        this.map.set(key, {value: value, size: size, expires: Date.now() + (ttl === undefined ? this.ttl : ttl)});
+        this.used += size;
+        while (this.map.size > this.max || this.used > this.maxSize)
+            this.delete(this.map.keys().next().value);
+    }
+
+    delete(key) {
+        let entry = this.map.get(key);
+        if (!entry)
+            return;
+        this.map.delete(key);
+        this.used -= entry.size;
+        this.onRemove(key, entry.value);
+    }
+
+    clear() {
+        Array.from(this.map.keys()).forEach(key => this.delete(key));
+    }
+
+    stats() {
+        let total = this.hits + this.misses;
+        return {
+            size: this.map.size,
+            used: this.used,
+            hits: this.hits,
+            misses: this.misses,
+            hitRate: total ? this.hits / total : 0
+        };
+    }
+}
+
+module.exports = LRU;
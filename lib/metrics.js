@@ -0,0 +1,214 @@
+/**
+ * Built-in metrics in the Prometheus text format, served by GET /metrics.
+ *
+ * Only counters and histograms with fixed buckets are kept, so recording a value
+ * is a few additions: cheap enough to stay enabled in production.
+ */
+"use strict";
+let monitorEventLoopDelay = require('perf_hooks').monitorEventLoopDelay;
+let broadcast = require('./broadcast');
+
+//config defaults
+let slowRequest = parseInt(process.env.SLOW_REQUEST_MS) || 1000; //ms, slower requests are logged with their queries
+
+let registry = [];
+
+let labelString = (names, values) => names.length ?
+    '{' + names.map((name, i) => `${name}="${String(values[i]).replace(/\\/g, '\\\\').replace(/"/g, '\\"')}"`).join(',') + '}' : '';
+
+class Counter {
+    constructor(name, help, labelNames) {
+        this.name = name;
+        this.help = help;
+        this.labelNames = labelNames || [];
+        this.values = new Map();
+        registry.push(this);
+    }
+
+    inc(labels, value) {
+        let key = (labels || []).join('\u0000');
+        let series = this.values.get(key);
+        if (!series)
+            this.values.set(key, series = {labels: labels || [], value: 0});
+        series.value += value === undefined ? 1 : value;
+    }
+
+    snapshot() {
+        return {name: this.name, help: this.help, type: 'counter', labelNames: this.labelNames, series: Array.from(this.values.values())};
+    }
+}
+
+class Histogram {
+    constructor(name, help, labelNames, buckets) {
+        this.name = name;
+        this.help = help;
+        this.labelNames = labelNames || [];
+        this.buckets = buckets;
+        this.values = new Map();
+        registry.push(this);
+    }
+
+    observe(labels, value) {
+        let key = (labels || []).join('\u0000');
+        let series = this.values.get(key);
+        if (!series)
+            this.values.set(key, series = {labels: labels || [], counts: this.buckets.map(() => 0), sum: 0, count: 0});
+        for (let i = 0; i < this.buckets.length; i++)
+            if (value <= this.buckets[i])
+                series.counts[i]++;
+        series.sum += value;
+        series.count++;
+    }
+
+    snapshot() {
+        return {name: this.name, help: this.help, type: 'histogram', labelNames: this.labelNames, buckets: this.buckets,
+            series: Array.from(this.values.values())};
+    }
+}
+
+//gauge read when metrics are rendered
+class Gauge {
+    constructor(name, help, labelNames, collect) {
+        this.name = name;
+        this.help = help;
+        this.labelNames = labelNames || [];
+        this.collect = collect; //returns [[labels, value], ...]
+        registry.push(this);
+    }
+
+    snapshot() {
+        return {name: this.name, help: this.help, type: 'gauge', labelNames: this.labelNames,
+            series: this.collect().map(sample => ({labels: sample[0], value: sample[1]}))};
+    }
+}
+
+/**
+ * Sums the snapshots of the same metrics taken in several processes.
+ * Gauges are not summed: every process keeps its series, with its pid in the worker label.
+ */
+function merge(snapshots) {
+    if (snapshots.length == 1)
+        return snapshots[0].metrics;
+    let metrics = new Map();
+    snapshots.forEach(snapshot => snapshot.metrics.forEach(metric => {
+        let merged = metrics.get(metric.name);
+        if (!merged) {
+            merged = Object.assign({}, metric, {series: new Map()});
+            if (metric.type == 'gauge')
+                merged.labelNames = metric.labelNames.concat('worker');
+            metrics.set(metric.name, merged);
+        }
+        metric.series.forEach(series => {
+            if (metric.type == 'gauge')
+                return merged.series.set(merged.series.size, {labels: series.labels.concat(snapshot.pid), value: series.value});
+            let key = series.labels.join('\u0000');
+            let total = merged.series.get(key);
+            if (!total)
+                return merged.series.set(key, JSON.parse(JSON.stringify(series)));
+            if (metric.type == 'counter')
+                return total.value += series.value;
+            series.counts.forEach((count, i) => total.counts[i] += count);
+            total.sum += series.sum;
+            total.count += series.count;
+        });
+    }));
+    return Array.from(metrics.values()).map(metric => Object.assign(metric, {series: Array.from(metric.series.values())}));
+}
+
+function renderMetric(metric) {
+    let name = metric.name;
+    let lines = [`# HELP ${name} ${metric.help}`, `# TYPE ${name} ${metric.type}`];
+    if (metric.type != 'histogram') {
+        metric.series.forEach(series => lines.push(name + labelString(metric.labelNames, series.labels) + ' ' + series.value));
+        return lines.join('\n');
+    }
+    let names = metric.labelNames.concat('le');
+    metric.series.forEach(series => {
+        metric.buckets.forEach((bucket, i) =>
+            lines.push(name + '_bucket' + labelString(names, series.labels.concat(bucket)) + ' ' + series.counts[i]));
+        lines.push(name + '_bucket' + labelString(names, series.labels.concat('+Inf')) + ' ' + series.count);
+        lines.push(name + '_sum' + labelString(metric.labelNames, series.labels) + ' ' + series.sum);
+        lines.push(name + '_count' + labelString(metric.labelNames, series.labels) + ' ' + series.count);
+    });
+    return lines.join('\n');
+}
+
+let seconds = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+
+let requestDuration = new Histogram('http_request_duration_seconds', 'Duration of HTTP requests', ['method', 'route', 'status'], seconds);
+let requestQueries = new Histogram('http_request_db_queries', 'Database queries run by an HTTP request', ['route'], [0, 1, 2, 3, 5, 10, 20, 50]);
+let requestQueryTime = new Histogram('http_request_db_seconds', 'Time spent in database queries by an HTTP request', ['route'], seconds);
+let serialization = new Histogram('json_serialization_seconds', 'Time spent in JSON.stringify of response bodies', [], seconds);
+let passwords = new Histogram('password_hash_duration_seconds', 'Time to hash or compare a password, queue wait included', ['op'], seconds.concat(20));
+let slowRequests = new Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS', ['route']);
+
+let loopDelay = monitorEventLoopDelay({resolution: 20});
+loopDelay.enable();
+new Gauge('nodejs_eventloop_lag_seconds', 'Event loop lag since the previous scrape', ['quantile'], () => {
+    let samples = [[[0.5], loopDelay.percentile(50) / 1e9], [[0.99], loopDelay.percentile(99) / 1e9], [['max'], loopDelay.max / 1e9]];
+    loopDelay.reset();
+    return samples;
+});
+
+exports.Counter = Counter;
+exports.Gauge = Gauge;
+exports.Histogram = Histogram;
+
+let sinceSeconds = start => {
+    let elapsed = process.hrtime(start);
+    return elapsed[0] + elapsed[1] / 1e9;
+};
+
+/**
+ * Records the time of a password job, returns its promise.
+ */
+exports.timePassword = (op, promise) => {
+    let start = process.hrtime();
+    let record = () => passwords.observe([op], sinceSeconds(start));
+    promise.then(record, record);
+    return promise;
+};
+
+/**
+ * Records duration, queries and JSON serialization of every request, logs the slow ones.
+ * @param context lib/context.js, its middleware must run before this one
+ */
+exports.middleware = (context) => (req, res, next) => {
+    let start = process.hrtime();
+    let current = context.current();
+
+    let json = res.json;
+    res.json = function(body) {
+        let begin = process.hrtime();
+        let text = JSON.stringify(body);
+        serialization.observe([], sinceSeconds(begin));
+        if (!this.get('Content-Type'))
+            this.set('Content-Type', 'application/json');
+        return text === undefined ? json.call(this, body) : this.send(text);
+    };
+
+    res.on('finish', () => {
+        let duration = sinceSeconds(start);
+        let route = req.route ? req.route.path : res.locals.route || 'unmatched';
+        requestDuration.observe([req.method, route, res.statusCode], duration);
+        if (!current)
+            return;
+        requestQueries.observe([route], current.queries);
+        requestQueryTime.observe([route], current.queryTime / 1e3);
+        if (duration * 1e3 >= slowRequest) {
+            slowRequests.inc([route]);
+            console.warn(`Slow request: ${req.method} ${req.originalUrl} ${res.statusCode} ${Math.round(duration * 1e3)}ms, ` +
+                `${current.queries} queries in ${Math.round(current.queryTime)}ms\n` +
+                current.log.map(query => `    ${query.ms === null ? '?' : query.ms.toFixed(1)}ms ${query.sql}`).join('\n'));
+        }
+    });
+    next();
+};
+
+broadcast.respond('metrics', () => ({pid: process.pid, metrics: registry.map(metric => metric.snapshot())}));
+
+/**
+ * Resolves to all the metrics in the Prometheus text format, summed over the worker processes of cluster.js.
+ */
+exports.render = () => broadcast.gather('metrics')
+    .then(snapshots => merge(snapshots).map(renderMetric).join('\n') + '\n');
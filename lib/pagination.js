@@ -0,0 +1,115 @@
+/**
+ * Keyset (cursor) pagination shared by the list controllers.
+ *
+ * The cursor is an opaque base64 token holding the ordering used for the page
+ * and the (order value, id) of its last row; the next page starts strictly after
+ * that pair, so rows inserted while a client is walking the list are never
+ * returned twice or skipped.
+ */
+"use strict";
+let url = require('url');
+
+//config defaults
+let maxLimit = parseInt(process.env.MAX_PAGE_SIZE) || 100;
+let defaultLimit = Math.min(parseInt(process.env.DEFAULT_PAGE_SIZE) || 25, maxLimit);
+
+function encodeCursor(values) {
+    return Buffer.from(JSON.stringify(values)).toString('base64')
+        .replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+}
+
+function decodeCursor(cursor) {
+    try {
+        let values = JSON.parse(Buffer.from(cursor.replace(/-/g, '+').replace(/_/g, '/'), 'base64').toString());
+        //the value and id go in the WHERE bindings: only a scalar and an integer
+        let valid = Array.isArray(values) && values.length == 4 &&
+            (typeof values[2] == 'string' || typeof values[2] == 'number') && Number.isInteger(values[3]);
+        return valid ? values : null;
+    } catch (e) {
+        return null;
+    }
+}
+
+/**
+ * Reads order, order_type, limit and cursor from the query string.
+ * Only the columns in sortable can be used as order, they should be backed by an index.
+ * Returns {order, orderType, limit, after} or {errors} in the 422 format used by the controllers.
+ */
+exports.parse = (req, sortable, defaultOrder, defaultOrderType) => {
+    let order = req.query.order || defaultOrder || 'created_at';
+    let orderType = req.query.order_type || defaultOrderType;
+    if(orderType!='desc')
+        orderType = 'asc';
+
+    let errors = [];
+    if(sortable.indexOf(order) < 0)
+        errors.push({param: 'order', msg: 'Order must be one of: ' + sortable.join(', '), value: order});
+    let limit = defaultLimit;
+    if(req.query.limit !== undefined) {
+        limit = parseInt(req.query.limit);
+        if(!(limit > 0))
+            errors.push({param: 'limit', msg: 'Limit must be a positive integer'});
+        limit = Math.min(limit, maxLimit);
+    }
+
+    let after = null;
+    if(req.query.cursor) {
+        after = decodeCursor(req.query.cursor);
+        if(!after || after[0] != order || after[1] != orderType)
+            errors.push({param: 'cursor', msg: 'Cursor is not valid for this ordering'});
+    }
+
+    if(errors.length)
+        return {errors: errors};
+    return {order: order, orderType: orderType, limit: limit, after: after && {value: after[2], id: after[3]}};
+};
+
+/**
+ * Columns the cursor of a page is made of, to be read also when the client chooses the fields.
+ */
+exports.columns = (page) => page.order == 'search_rank' ? ['id'] : ['id', page.order];
+
+/**
+ * Adds ordering, the keyset condition and the limit to a knex query builder.
+ * One row more than the page size is fetched to know whether a next page exists.
+ */
+exports.apply = (qb, page, tableName) => {
+    //search_rank is computed by the search join, it isn't a column of the table
+    let column = name => tableName && name != 'search_rank' ? tableName + '.' + name : name;
+    let op = page.orderType == 'desc' ? '<' : '>';
+
+    if(page.after) {
+        let after = page.after;
+        qb.where(function() {
+            this.where(column(page.order), op, after.value)
+                .orWhere(function() {
+                    this.where(column(page.order), after.value).andWhere(column('id'), op, after.id);
+                });
+        });
+    }
+    return qb.orderBy(column(page.order), page.orderType)
+        .orderBy(column('id'), page.orderType)
+        .limit(page.limit + 1);
+};
+
+/**
+ * Trims the extra row fetched by apply() and sets the Link header to the next page.
+ * Returns the collection to send.
+ */
+exports.paginate = (req, res, collection, page) => {
+    if(collection.length <= page.limit)
+        return collection;
+
+    collection.pop();
+    let last = collection.last();
+    let value = last.get(page.order);
+    if(value instanceof Date)
+        value = value.toISOString();
+
+    let query = Object.assign({}, req.query, {
+        limit: page.limit,
+        cursor: encodeCursor([page.order, page.orderType, value, last.get('id')])
+    });
+    res.links({next: url.format({pathname: req.baseUrl + req.path, query: query})});
+    return collection;
+};
@@ -0,0 +1,19 @@
+/**
+ * Worker thread body for lib/passwords.js: runs bcrypt away from the event loop.
+ */
+"use strict";
+let bcrypt = require('bcrypt-nodejs');
+let parentPort = require('worker_threads').parentPort;
+
+parentPort.on('message', job => {
+    try {
+        let result;
+        if (job.op == 'hash')
+            result = bcrypt.hashSync(job.password, bcrypt.genSaltSync(job.cost));
+        else
+            result = bcrypt.compareSync(job.password, job.hash);
+        parentPort.postMessage({result: result});
+    } catch (err) {
+        parentPort.postMessage({error: String(err.message || err)});
+    }
+});
@@ -0,0 +1,101 @@
+/**
+ * Password hashing and comparison on a pool of worker threads.
+ *
+ * bcrypt-nodejs is pure JavaScript, so running it on the main thread blocks every
+ * other request for the whole hash. Jobs wait in a bounded queue; when the queue
+ * is full they are rejected with err.code = 'EQUEUEFULL' and callers answer 503.
+ */
+"use strict";
+let os = require('os');
+let path = require('path');
+let Worker = require('worker_threads').Worker;
+let metrics = require('./metrics');
+
+//config defaults
+let cost = parseInt(process.env.BCRYPT_COST) || 10;
+let poolSize = parseInt(process.env.PASSWORD_WORKERS) || Math.max(os.cpus().length - 1, 1);
+let maxQueue = parseInt(process.env.PASSWORD_QUEUE_SIZE) || 1000;
+
+let idle = [];
+let queue = [];
+let started = false;
+
+function spawn() {
+    let worker = new Worker(path.join(__dirname, 'passwordWorker.js'));
+    worker.on('message', message => {
+        let job = worker.job;
+        worker.job = null;
+        if (message.error)
+            job.reject(new Error(message.error));
+        else
+            job.resolve(message.result);
+        release(worker);
+    });
+    worker.on('error', err => {
+        if (worker.job)
+            worker.job.reject(err);
+        worker.job = null;
+    });
+    worker.on('exit', () => {
+        //replace crashed workers
+        let i = idle.indexOf(worker);
+        if (i >= 0)
+            idle.splice(i, 1);
+        if (worker.job)
+            worker.job.reject(new Error('Password worker exited'));
+        release(spawn());
+    });
+    return worker;
+}
+
+function assign(worker, job) {
+    worker.job = job;
+    worker.ref();
+    worker.postMessage(job.message);
+}
+
+function release(worker) {
+    let job = queue.shift();
+    if (job)
+        return assign(worker, job);
+    worker.unref(); //an idle pool must not keep the process alive
+    idle.push(worker);
+}
+
+function run(message) {
+    if (!started) {
+        started = true;
+        for (let i = 0; i < poolSize; i++)
+            release(spawn());
+    }
+    return new Promise((resolve, reject) => {
+        let job = {message: message, resolve: resolve, reject: reject};
+        let worker = idle.pop();
+        if (worker)
+            return assign(worker, job);
+        if (queue.length >= maxQueue) {
+            let err = new Error('Password queue is full');
+            err.code = 'EQUEUEFULL';
+            return reject(err);
+        }
+        queue.push(job);
+    });
+}
+
+/**
+ * Resolves to the bcrypt hash of password with the configured cost.
+ */
+exports.hash = (password) => metrics.timePassword('hash', run({op: 'hash', password: password, cost: cost}));
+
+/**
+ * Resolves to true if password matches hash.
+ */
+exports.compare = (password, hash) => metrics.timePassword('compare', run({op: 'compare', password: password, hash: hash || ''}));
+
+/**
+ * True if hash was made with a cost different from the configured one.
+ */
+exports.needsRehash = (hash) => {
+    let match = /^\$2[aby]?\$(\d+)\$/.exec(hash || '');
+    return !match || parseInt(match[1]) != cost;
+};
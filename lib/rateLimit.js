@@ -0,0 +1,153 @@
+/**
+ * Rate limits per client and admission control, so the service degrades predictably under overload.
+ *
+ * limiter() gives every client IP or user a token bucket of `burst` tokens refilled at `rate`
+ * per second; a request without a token gets a 429 with Retry-After. With cluster.js the
+ * buckets are kept by the primary, so a client has the same allowance whatever worker serves it.
+ *
+ * admission() caps the requests served at the same time by this process; the others wait
+ * in a queue and get a 503 with Retry-After when the queue is full or they waited too long.
+ */
+"use strict";
+let AsyncResource = require('async_hooks').AsyncResource;
+let broadcast = require('./broadcast');
+let LRU = require('./lru');
+let metrics = require('./metrics');
+
+//config defaults
+let enabled = process.env.RATE_LIMITS != 'off'; //off to benchmark from a single client
+let maxBuckets = parseInt(process.env.RATE_LIMIT_KEYS) || 100000;
+
+let buckets = new LRU({max: maxBuckets});
+
+let limited = new metrics.Counter('http_rate_limited_total', 'Requests rejected with 429 by a rate limiter', ['limiter']);
+let shed = new metrics.Counter('http_shed_total', 'Requests rejected with 503 by admission control', ['reason']);
+let admissions = [];
+new metrics.Gauge('http_admission_requests', 'Requests served and queued by admission control', ['state'], () => [
+    [['active'], admissions.reduce((sum, admission) => sum + admission.active, 0)],
+    [['queued'], admissions.reduce((sum, admission) => sum + admission.queue.length, 0)]
+]);
+
+/**
+ * Takes a token from the bucket of key; resolves to 0, or to the seconds before a token is available.
+ */
+function take(request) {
+    let now = Date.now();
+    let bucket = buckets.get(request.key) || {tokens: request.burst, time: now};
+    bucket.tokens = Math.min(request.burst, bucket.tokens + (now - bucket.time) / 1000 * request.rate);
+    bucket.time = now;
+    let wait = 0;
+    if (bucket.tokens >= 1)
+        bucket.tokens--;
+    else
+        wait = (1 - bucket.tokens) / request.rate;
+    //a bucket that would be full again can be forgotten
+    buckets.set(request.key, bucket, Math.ceil(request.burst / request.rate * 1000));
+    return wait;
+}
+
+broadcast.serve('rateLimit', take);
+broadcast.serve('rateLimit:clear', () => buckets.clear());
+
+/**
+ * Forgets the buckets of all the clients, in the primary with cluster.js. Returns a promise.
+ */
+exports.clear = () => broadcast.request('rateLimit:clear');
+
+/**
+ * Middleware limiting the requests of a client to rate per second, with bursts of burst requests.
+ * @param name name of the limiter, clients have a bucket per limiter
+ * @param options.per 'ip', or 'user' for the authenticated user (the IP for anonymous requests)
+ */
+exports.limiter = (name, options) => {
+    let rate = options.rate;
+    let burst = options.burst || Math.max(Math.ceil(rate), 1);
+    return (req, res, next) => {
+        if (!enabled)
+            return next();
+        let client = options.per == 'user' && req.user ? 'user:' + req.user.id : 'ip:' + req.ip;
+        broadcast.request('rateLimit', {key: name + ' ' + client, rate: rate, burst: burst})
+            .then(wait => {
+                if (!wait)
+                    return next();
+                limited.inc([name]);
+                res.set('Retry-After', String(Math.ceil(wait)));
+                res.status(429).send({msg: 'Too many requests, retry later'});
+            })
+            .catch(err => {
+                //the limiter is a protection, it doesn't stop the service when it fails
+                console.error(err);
+                next();
+            });
+    };
+};
+
+/**
+ * Middleware serving at most options.max requests at the same time.
+ * @param options.queue maximum number of waiting requests
+ * @param options.wait ms a request can wait before getting a 503
+ * @param options.except paths that are always served, e.g. monitoring
+ */
+exports.admission = (options) => {
+    let admission = {active: 0, queue: []};
+    admissions.push(admission);
+    let except = options.except || [];
+    let retryAfter = String(Math.max(Math.ceil(options.wait / 1000), 1));
+
+    let reject = (res, reason) => {
+        shed.inc([reason]);
+        res.set('Retry-After', retryAfter);
+        res.status(503).send({msg: 'Server busy, retry later'});
+    };
+
+    let admit = () => {
+        while (admission.queue.length && admission.active < options.max) {
+            let waiting = admission.queue.shift();
+            clearTimeout(waiting.timer);
+            waiting.start();
+        }
+    };
+
+    return (req, res, next) => {
+        if (except.indexOf(req.path) >= 0)
+            return next();
+
+        let start = () => {
+            let done = false;
+            let release = () => {
+                if (done)
+                    return;
+                done = true;
+                admission.active--;
+                admit();
+            };
+            admission.active++;
+            res.on('finish', release);
+            res.on('close', release);
+            next();
+        };
+
+        if (admission.active < options.max)
+            return start();
+        if (admission.queue.length >= options.queue)
+            return reject(res, 'queue_full');
+
+        //start runs when another request finishes, it must keep the context of this one (lib/context.js)
+        let waiting = {start: AsyncResource.bind(start)};
+        let leave = () => {
+            let i = admission.queue.indexOf(waiting);
+            if (i >= 0)
+                admission.queue.splice(i, 1);
+            return i >= 0;
+        };
+        waiting.timer = setTimeout(() => {
+            if (leave())
+                reject(res, 'queue_timeout');
+        }, options.wait);
+        res.on('close', () => {
+            if (leave()) //the client went away while waiting
+                clearTimeout(waiting.timer);
+        });
+        admission.queue.push(waiting);
+    };
+};
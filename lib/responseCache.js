@@ -0,0 +1,187 @@
+/**
+ * Cache of the responses of the public read endpoints GET /games, /games/:id and /users/:id.
+ *
+ * The body is stored as sent, after compression, so a hit skips the database,
+ * toJSON() and gzip. Entries are tagged ('games', 'game:ID', 'user:ID') and the
+ * controllers invalidate tags when they write. The store is pluggable: it must
+ * implement get(key), set(key, entry, tags), invalidate(tag) and clear(), all
+ * returning promises, so a shared store can be used by several nodes.
+ */
+"use strict";
+let broadcast = require('./broadcast');
+let LRU = require('./lru');
+let streaming = require('./streaming');
+
+//config defaults
+let maxSize = parseInt(process.env.RESPONSE_CACHE_SIZE) || 64 * 1024 * 1024; //bytes
+let ttl = (parseInt(process.env.RESPONSE_CACHE_TTL) || 300) * 1000;
+let maxEntrySize = 1024 * 1024; //bigger responses are not cached
+
+//query parameters that change the response, the others are ignored in the key
+let keyParameters = ['order', 'order_type', 'search', 'limit', 'cursor', 'fields'];
+
+//cacheable routes: path pattern, and tag of its entries from the matched id
+let routes = [
+    {path: '/games/', pattern: /^\/games\/?$/, tag: () => 'games'},
+    {path: '/games/:id', pattern: /^\/games\/(\d+)\/?$/, tag: match => 'game:' + match[1]},
+    {path: '/users/:id', pattern: /^\/users\/(\d+)\/?$/, tag: match => 'user:' + match[1]},
+];
+
+//headers stored with the body
+let storedHeaders = ['Content-Type', 'Content-Encoding', 'ETag', 'Last-Modified', 'Link', 'Vary'];
+
+/**
+ * In-process store with LRU eviction bounded by the total size of the bodies.
+ */
+class MemoryStore {
+    constructor(options) {
+        this.tags = new Map(); //tag -> Set of keys
+        this.entries = new LRU({
+            ttl: options.ttl,
+            maxSize: options.maxSize,
+            sizeOf: entry => entry.body.length,
+            onRemove: (key, entry) => entry.tags.forEach(tag => {
+                let keys = this.tags.get(tag);
+                if (keys && keys.delete(key) && !keys.size)
+                    this.tags.delete(tag);
+            })
+        });
+    }
+
+    get(key) {
+        return Promise.resolve(this.entries.get(key));
+    }
+
+    set(key, entry, tags) {
+        entry.tags = tags;
+        this.entries.set(key, entry);
+        tags.forEach(tag => {
+            if (!this.tags.has(tag))
+                this.tags.set(tag, new Set());
+            this.tags.get(tag).add(key);
+        });
+        return Promise.resolve();
+    }
+
+    invalidate(tag) {
+        let keys = this.tags.get(tag);
+        if (keys)
+            Array.from(keys).forEach(key => this.entries.delete(key));
+        return Promise.resolve();
+    }
+
+    clear() {
+        this.entries.clear();
+        return Promise.resolve();
+    }
+
+    stats() {
+        return this.entries.stats();
+    }
+}
+
+let store = new MemoryStore({maxSize: maxSize, ttl: ttl});
+//incremented at every invalidation, a response computed meanwhile is not stored
+let generation = 0;
+
+function keyOf(req) {
+    let query = keyParameters.filter(name => req.query[name] !== undefined)
+        .map(name => name + '=' + encodeURIComponent(req.query[name]));
+    return req.path.replace(/\/$/, '') + '?' + query.join('&');
+}
+
+/**
+ * Serves cached responses and stores new ones. Must be used before compression().
+ */
+exports.middleware = (req, res, next) => {
+    //streams are sent as NDJSON, also when asked with the Accept header: never under the key of the JSON list
+    if (req.method != 'GET' || req.query.stream !== undefined || streaming.requested(req) || !req.acceptsEncodings('gzip'))
+        return next();
+    let route = routes.find(route => route.pattern.test(req.path));
+    if (!route)
+        return next();
+    let tag = route.tag(route.pattern.exec(req.path));
+    let key = keyOf(req);
+
+    store.get(key).then(entry => {
+        if (entry) {
+            res.locals.route = route.path; //for lib/metrics.js, no express route handles a hit
+            res.set(entry.headers);
+            res.set('X-Cache', 'HIT');
+            if (req.fresh)
+                return res.status(304).end();
+            return res.status(200).end(entry.body);
+        }
+        res.set('X-Cache', 'MISS');
+        capture(req, res, key, [tag]);
+        next();
+    }).catch(err => {
+        console.error(err);
+        next();
+    });
+};
+
+//collects the body written by compression() and stores it when the response ends
+function capture(req, res, key, tags) {
+    let started = generation;
+    let chunks = [];
+    let length = 0;
+    let write = res.write;
+    let end = res.end;
+    let collect = (chunk, encoding) => {
+        if (!chunk || chunks === null)
+            return;
+        chunk = Buffer.isBuffer(chunk) ? chunk : Buffer.from(chunk, typeof encoding == 'string' ? encoding : 'utf8');
+        length += chunk.length;
+        if (length > maxEntrySize)
+            chunks = null;
+        else
+            chunks.push(chunk);
+    };
+    res.write = function(chunk, encoding) {
+        collect(chunk, encoding);
+        return write.apply(this, arguments);
+    };
+    res.end = function(chunk, encoding) {
+        collect(chunk, encoding);
+        if (chunks !== null && res.statusCode == 200 && started == generation) {
+            let headers = {};
+            storedHeaders.forEach(name => {
+                let value = res.getHeader(name);
+                if (value !== undefined)
+                    headers[name] = value;
+            });
+            store.set(key, {headers: headers, body: Buffer.concat(chunks)}, tags)
+                .catch(err => console.error(err));
+        }
+        return end.apply(this, arguments);
+    };
+}
+
+/**
+ * Drops the responses with the given tag: 'games' for the game lists, 'game:ID', 'user:ID'.
+ */
+exports.invalidate = (tag) => broadcast.publish('responseCache:invalidate', tag);
+
+exports.clear = () => broadcast.publish('responseCache:clear');
+
+//every worker process of cluster.js drops its copies; a shared store just receives the same call more than once
+broadcast.subscribe('responseCache:invalidate', tag => {
+    generation++;
+    return store.invalidate(tag).catch(err => console.error(err));
+});
+broadcast.subscribe('responseCache:clear', () => {
+    generation++;
+    return store.clear();
+});
+
+/**
+ * Replaces the store, e.g. with one shared by several nodes.
+ */
+exports.setStore = (newStore) => {
+    store = newStore;
+};
+
+exports.stats = () => store.stats ? store.stats() : {};
+
+exports.MemoryStore = MemoryStore;
@@ -0,0 +1,39 @@
+/**
+ * Full-text search on the indexes created by the search migration:
+ * FTS5 tables on sqlite, tsvector columns with GIN indexes on Postgres.
+ *
+ * apply() joins the matching rows and adds a search_rank column, higher is more
+ * relevant, that can be used for ordering and keyset pagination.
+ */
+"use strict";
+let bookshelf = require('../bookshelf');
+
+let isPostgres = () => bookshelf.knex.client.config.client == 'pg';
+
+/**
+ * Splits the search parameter into words; punctuation and operators are dropped
+ * so user input can never be a malformed FTS query.
+ */
+exports.terms = (search) => {
+    return (search || '').match(/[\p{L}\p{N}]+/gu) || [];
+};
+
+/**
+ * Restricts the query on table (games or plays) to the rows matching all the terms,
+ * every term also matches as a prefix.
+ */
+exports.apply = (qb, table, terms) => {
+    let sql, query;
+    if (isPostgres()) {
+        query = terms.map(term => term + ':*').join(' & ');
+        sql = `INNER JOIN (SELECT id AS search_id, ts_rank(search_vector, search_query) AS search_rank
+            FROM ${table}, to_tsquery('simple', ?) search_query WHERE search_vector @@ search_query) AS search_matches
+            ON search_matches.search_id = ${table}.id`;
+    } else {
+        query = terms.map(term => '"' + term + '"*').join(' ');
+        sql = `INNER JOIN (SELECT rowid AS search_id, -bm25(${table}_fts) AS search_rank
+            FROM ${table}_fts WHERE ${table}_fts MATCH ?) AS search_matches
+            ON search_matches.search_id = ${table}.id`;
+    }
+    return qb.joinRaw(sql, [query]).select('search_matches.search_rank');
+};
@@ -0,0 +1,182 @@
+/**
+ * Incremental play statistics stored in the play_stats table.
+ *
+ * Every (user, game) row counts the plays the user recorded for the game, the
+ * plays of the game they won (the winner key of additional_data) and the last
+ * played_at. Writers call record()/removeUser() in the transaction that changes
+ * the plays; rebuild() recomputes everything from the plays table.
+ */
+"use strict";
+
+//rows per INSERT statement, sqlite accepts at most 999 bound variables per statement
+let chunkSize = 100;
+
+function chunks(list, size) {
+    let result = [];
+    for (let i = 0; i < list.length; i += size)
+        result.push(list.slice(i, i + size));
+    return result;
+}
+
+function winnerOf(play) {
+    let data = play.additional_data;
+    if (data === undefined) {
+        try {
+            data = JSON.parse(play.json_additional_data);
+        } catch (e) {
+            return null;
+        }
+    }
+    let winner = data && typeof data == 'object' ? parseInt(data.winner) : NaN;
+    return isNaN(winner) ? null : winner;
+}
+
+/**
+ * Aggregates plays into one delta per (user, game).
+ */
+function deltas(plays, sign) {
+    let rows = new Map();
+    let row = (userId, gameId) => {
+        let key = userId + ':' + gameId;
+        if (!rows.has(key))
+            rows.set(key, {user_id: userId, game_id: gameId, plays: 0, wins: 0, last_played_at: null});
+        return rows.get(key);
+    };
+    plays.forEach(play => {
+        let gameId = parseInt(play.game_id);
+        let own = row(parseInt(play.user_id), gameId);
+        own.plays += sign;
+        if (play.played_at !== undefined && play.played_at !== null
+            && (own.last_played_at === null || play.played_at > own.last_played_at))
+            own.last_played_at = play.played_at;
+        let winner = winnerOf(play);
+        if (winner !== null)
+            row(winner, gameId).wins += sign;
+    });
+    return Array.from(rows.values());
+}
+
+/**
+ * Drops the deltas that only give wins to users that don't exist (any id can be the winner of a play),
+ * the owners of the plays exist.
+ */
+function ofUsers(knex, rows) {
+    let ids = Array.from(new Set(rows.filter(row => !row.plays).map(row => row.user_id)));
+    return Promise.all(chunks(ids, 500).map(chunk => knex('users').whereIn('id', chunk).pluck('id')))
+        .then(found => {
+            let existing = new Set([].concat.apply([], found).map(id => parseInt(id)));
+            return rows.filter(row => row.plays || existing.has(row.user_id));
+        });
+}
+
+//adds a chunk of deltas with one statement, the same on sqlite (>= 3.24) and Postgres
+function upsert(trx, rows) {
+    let values = rows.map(() => '(?, ?, ?, ?, ?)').join(', ');
+    let bindings = [].concat.apply([], rows.map(row => [row.user_id, row.game_id, row.plays, row.wins, row.last_played_at]));
+    return trx.raw(`INSERT INTO play_stats (user_id, game_id, plays, wins, last_played_at) VALUES ${values}
+        ON CONFLICT (user_id, game_id) DO UPDATE SET
+            plays = play_stats.plays + excluded.plays,
+            wins = play_stats.wins + excluded.wins,
+            last_played_at = CASE WHEN play_stats.last_played_at IS NULL OR play_stats.last_played_at < excluded.last_played_at
+                THEN excluded.last_played_at ELSE play_stats.last_played_at END`, bindings);
+}
+
+function update(trx, row) {
+    let changes = {
+        plays: trx.raw('plays + ?', [row.plays]),
+        wins: trx.raw('wins + ?', [row.wins])
+    };
+    if (row.last_played_at !== null)
+        changes.last_played_at = trx.raw('CASE WHEN last_played_at IS NULL OR last_played_at < ? THEN ? ELSE last_played_at END',
+            [row.last_played_at, row.last_played_at]);
+    return trx('play_stats').where({user_id: row.user_id, game_id: row.game_id}).update(changes);
+}
+
+/**
+ * Adds new plays (with additional_data or json_additional_data) to the statistics.
+ */
+exports.record = (trx, plays) => {
+    return ofUsers(trx, deltas(plays, 1))
+        .then(rows => chunks(rows, chunkSize).reduce((previous, chunk) => previous.then(() => upsert(trx, chunk)), Promise.resolve()));
+};
+
+/**
+ * Removes a user from the statistics: their rows, and the wins their plays gave to other users.
+ */
+exports.removeUser = (trx, userId) => {
+    return trx('plays').where('user_id', userId).select('user_id', 'game_id', 'json_additional_data')
+        .then(plays => deltas(plays, -1)
+            .filter(row => row.user_id != userId && row.wins)
+            .reduce((previous, row) => previous.then(() => update(trx, {
+                user_id: row.user_id, game_id: row.game_id, plays: 0, wins: row.wins, last_played_at: null
+            })), Promise.resolve()))
+        .then(() => trx('play_stats').where('user_id', userId).del());
+};
+
+/**
+ * Recomputes the whole table from the plays of existing users and games.
+ */
+exports.rebuild = (knex) => {
+    let all = new Map();
+    let scan = (afterId) => knex('plays')
+        .join('users', 'users.id', 'plays.user_id')
+        .join('games', 'games.id', 'plays.game_id')
+        .where('plays.id', '>', afterId)
+        .orderBy('plays.id')
+        .limit(1000)
+        .select('plays.id', 'plays.user_id', 'plays.game_id', 'plays.played_at', 'plays.json_additional_data')
+        .then(plays => {
+            deltas(plays, 1).forEach(row => {
+                let key = row.user_id + ':' + row.game_id;
+                let total = all.get(key);
+                if (!total)
+                    return all.set(key, row);
+                total.plays += row.plays;
+                total.wins += row.wins;
+                if (row.last_played_at !== null && (total.last_played_at === null || row.last_played_at > total.last_played_at))
+                    total.last_played_at = row.last_played_at;
+            });
+            return plays.length ? scan(plays[plays.length - 1].id) : null;
+        });
+
+    return scan(0).then(() => knex.transaction(trx => ofUsers(trx, Array.from(all.values()))
+        .then(rows => trx('play_stats').del()
+            .then(() => chunks(rows, chunkSize).reduce((previous, chunk) => previous.then(() => trx('play_stats').insert(chunk)), Promise.resolve()))
+            .then(() => rows.length))
+    ));
+};
+
+/**
+ * Statistics of a user, one entry per game played or won.
+ */
+exports.forUser = (knex, userId) => {
+    return knex('play_stats').where('user_id', userId).orderBy('game_id')
+        .select('game_id', 'plays', 'wins', 'last_played_at')
+        .then(rows => {
+            let result = {plays: 0, wins: 0, last_played_at: null, games: []};
+            rows.forEach(row => {
+                result.plays += row.plays;
+                result.wins += row.wins;
+                if (row.last_played_at !== null && (result.last_played_at === null || row.last_played_at > result.last_played_at))
+                    result.last_played_at = row.last_played_at;
+                row.links = {game: '/games/' + row.game_id, stats: '/games/' + row.game_id + '/stats'};
+                result.games.push(row);
+            });
+            return result;
+        });
+};
+
+/**
+ * Statistics of a game over all users.
+ */
+exports.forGame = (knex, gameId) => {
+    return knex('play_stats').where('game_id', gameId)
+        .first(knex.raw('coalesce(sum(plays), 0) as plays'), knex.raw('coalesce(sum(wins), 0) as wins'),
+            knex.raw('sum(case when plays > 0 then 1 else 0 end) as players'), knex.raw('max(last_played_at) as last_played_at'))
+        .then(row => ({
+            plays: parseInt(row.plays),
+            wins: parseInt(row.wins),
+            players: parseInt(row.players) || 0,
+            last_played_at: row.last_played_at
+        }));
+};
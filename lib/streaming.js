@@ -0,0 +1,80 @@
+/**
+ * Streaming of whole lists as NDJSON (one JSON object per line), for exports.
+ *
+ * Rows are read in keyset pages of STREAM_CHUNK_SIZE rows, the next page only when
+ * the response has drained the previous one, so memory stays flat however many
+ * rows the list has, both on sqlite and Postgres.
+ */
+"use strict";
+let stream = require('stream');
+let pagination = require('./pagination');
+
+//config defaults
+let chunkSize = parseInt(process.env.STREAM_CHUNK_SIZE) || 500;
+
+class RowStream extends stream.Readable {
+    /**
+     * @param query function returning a new query builder with columns and filters, without ordering
+     * @param page ordering (and starting cursor) from pagination.parse
+     */
+    constructor(query, page, tableName) {
+        super({objectMode: true});
+        this.query = query;
+        //apply() fetches limit + 1 rows
+        this.page = {order: page.order, orderType: page.orderType, after: page.after, limit: chunkSize - 1};
+        this.tableName = tableName;
+        this.loading = false;
+    }
+
+    _read() {
+        if (this.loading)
+            return;
+        this.loading = true;
+        pagination.apply(this.query(), this.page, this.tableName)
+            .then(rows => {
+                this.loading = false;
+                if (rows.length) {
+                    let last = rows[rows.length - 1];
+                    this.page.after = {value: last[this.page.order], id: last.id};
+                }
+                rows.forEach(row => this.push(row));
+                if (rows.length < chunkSize)
+                    this.push(null);
+            }, err => this.destroy(err));
+    }
+}
+
+/**
+ * True if the client asked for a stream, with ?stream=1 or Accept: application/x-ndjson.
+ */
+exports.requested = (req) => {
+    return req.query.stream == '1' || req.accepts(['application/json', 'application/x-ndjson']) == 'application/x-ndjson';
+};
+
+/**
+ * Sends all the rows of query as NDJSON, serialize turns a database row into the object to send.
+ */
+exports.send = (res, query, page, tableName, serialize) => {
+    let lines = new stream.Transform({
+        writableObjectMode: true,
+        transform(row, encoding, done) {
+            let line;
+            try {
+                line = JSON.stringify(serialize(row)) + '\n';
+            } catch (err) {
+                return done(err);
+            }
+            done(null, line);
+        }
+    });
+    stream.pipeline(new RowStream(query, page, tableName), lines, err => {
+        if (!err)
+            return;
+        console.error(err);
+        if (res.headersSent)
+            return res.destroy(err);
+        res.status(500).send({msg: "Internal server Error"});
+    });
+    res.type('application/x-ndjson');
+    lines.pipe(res); //pipe waits for 'drain', so the rows are read as fast as the client receives them
+};
@@ -0,0 +1,72 @@
+"use strict";
+//full-text indexes for the search parameter of game and play lists, see lib/search.js
+let indexed = {
+    games: ['name', 'json_designers'],
+    plays: ['name', 'json_additional_data']
+};
+
+function sqliteUp(table, columns) {
+    let cols = columns.join(', ');
+    let news = columns.map(c => 'new.' + c).join(', ');
+    let olds = columns.map(c => 'old.' + c).join(', ');
+    return [
+        `CREATE VIRTUAL TABLE ${table}_fts USING fts5(${cols}, content='${table}', content_rowid='id')`,
+        `CREATE TRIGGER ${table}_fts_insert AFTER INSERT ON ${table} BEGIN
+            INSERT INTO ${table}_fts(rowid, ${cols}) VALUES (new.id, ${news});
+        END`,
+        `CREATE TRIGGER ${table}_fts_delete AFTER DELETE ON ${table} BEGIN
+            INSERT INTO ${table}_fts(${table}_fts, rowid, ${cols}) VALUES ('delete', old.id, ${olds});
+        END`,
+        `CREATE TRIGGER ${table}_fts_update AFTER UPDATE ON ${table} BEGIN
+            INSERT INTO ${table}_fts(${table}_fts, rowid, ${cols}) VALUES ('delete', old.id, ${olds});
+            INSERT INTO ${table}_fts(rowid, ${cols}) VALUES (new.id, ${news});
+        END`,
+        `INSERT INTO ${table}_fts(${table}_fts) VALUES ('rebuild')`
+    ];
+}
+
+function sqliteDown(table) {
+    return [
+        `DROP TRIGGER IF EXISTS ${table}_fts_insert`,
+        `DROP TRIGGER IF EXISTS ${table}_fts_delete`,
+        `DROP TRIGGER IF EXISTS ${table}_fts_update`,
+        `DROP TABLE IF EXISTS ${table}_fts`
+    ];
+}
+
+function postgresUp(table, columns) {
+    let document = columns.map(c => `coalesce(${c}, '')`).join(` || ' ' || `);
+    return [
+        `ALTER TABLE ${table} ADD COLUMN search_vector tsvector`,
+        `UPDATE ${table} SET search_vector = to_tsvector('simple', ${document})`,
+        `CREATE INDEX ${table}_search_vector_index ON ${table} USING gin(search_vector)`,
+        `CREATE TRIGGER ${table}_search_vector_update BEFORE INSERT OR UPDATE ON ${table}
+            FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', ${columns.join(', ')})`
+    ];
+}
+
+function postgresDown(table) {
+    return [
+        `DROP TRIGGER IF EXISTS ${table}_search_vector_update ON ${table}`,
+        `ALTER TABLE ${table} DROP COLUMN IF EXISTS search_vector`
+    ];
+}
+
+//statements must run one after the other
+function run(knex, statements) {
+    return statements.reduce((previous, sql) => previous.then(() => knex.raw(sql)), Promise.resolve());
+}
+
+exports.up = function(knex, Promise) {
+    let isPostgres = knex.client.config.client == 'pg';
+    return run(knex, [].concat.apply([], Object.keys(indexed).map(table =>
+        isPostgres ? postgresUp(table, indexed[table]) : sqliteUp(table, indexed[table])
+    )));
+};
+
+exports.down = function(knex, Promise) {
+    let isPostgres = knex.client.config.client == 'pg';
+    return run(knex, [].concat.apply([], Object.keys(indexed).map(table =>
+        isPostgres ? postgresDown(table) : sqliteDown(table)
+    )));
+};
@@ -0,0 +1,20 @@
+"use strict";
+//per user and game aggregates of the plays, maintained by lib/stats.js
+exports.up = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.createTable('play_stats', function(table) {
+            table.integer('user_id').unsigned().notNullable();
+            table.integer('game_id').unsigned().notNullable().index();
+            table.integer('plays').notNullable().defaultTo(0); //plays of the game recorded by the user
+            table.integer('wins').notNullable().defaultTo(0); //plays of the game won by the user
+            table.datetime('last_played_at');
+            table.primary(['user_id', 'game_id']);
+        })
+    ]);
+};
+
+exports.down = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.dropTable('play_stats')
+    ])
+};
@@ -0,0 +1,24 @@
+"use strict";
+//indexes for the play lists of a user, ordered by played_at or created_at, optionally of a single game;
+//the one on user_id alone becomes redundant
+exports.up = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.table('plays', function(table) {
+            table.index(['user_id', 'played_at']);
+            table.index(['user_id', 'game_id', 'played_at']);
+            table.index(['user_id', 'created_at']);
+            table.dropIndex('user_id');
+        })
+    ]);
+};
+
+exports.down = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.table('plays', function(table) {
+            table.index('user_id');
+            table.dropIndex(['user_id', 'played_at']);
+            table.dropIndex(['user_id', 'game_id', 'played_at']);
+            table.dropIndex(['user_id', 'created_at']);
+        })
+    ]);
+};
@@ -0,0 +1,17 @@
+"use strict";
+//play lists of a user ordered by game_id: the id that breaks ties must be in the index too
+exports.up = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.table('plays', function(table) {
+            table.index(['user_id', 'game_id', 'id']);
+        })
+    ]);
+};
+
+exports.down = function(knex, Promise) {
+    return Promise.all([
+        knex.schema.table('plays', function(table) {
+            table.dropIndex(['user_id', 'game_id', 'id']);
+        })
+    ]);
+};
@@ -0,0 +1,21 @@
+"use strict";
+//strong ETag of the cover, computed when a game is saved so /games/:id/cover can answer 304 without reading it
+let conditional = require('../lib/conditional');
+
+exports.up = function(knex, Promise) {
+    return knex.schema.table('games', function(table) {
+        table.string('cover_etag');
+    })
+        .then(() => knex('games').select('id'))
+        //one cover at a time, they can be big
+        .then(games => games.reduce((previous, game) => previous
+            .then(() => knex('games').where('id', game.id).first('cover'))
+            .then(row => knex('games').where('id', game.id).update({cover_etag: conditional.digest(row.cover)})),
+            Promise.resolve()));
+};
+
+exports.down = function(knex, Promise) {
+    return knex.schema.table('games', function(table) {
+        table.dropColumn('cover_etag');
+    });
+};
@@ -4,13 +4,25 @@
 "use strict";
 let bcrypt = require('bcrypt-nodejs');
 let bookshelf = require('../bookshelf');
+let conditional = require('../lib/conditional');
 bookshelf.plugin('registry');
 
 
 let Game = bookshelf.Model.extend({
     tableName: 'games',
     hasTimestamps: true, //manage in automatic way created_at and updated_at
-    hidden: ['json_designers'], //hide from json deserialized
+    //hide from json deserialized, cover is served by /games/:id/cover, search_rank is only for ordering
+    hidden: ['json_designers', 'cover', 'cover_etag', 'search_vector', 'search_rank'],
+
+    initialize: function() {
+        this.on('saving', this.hashCover, this);
+    },
+
+    //the ETag of the cover is computed once, when it is written, not for every /games/:id/cover
+    hashCover: function(model) {
+        if (model.get('cover') !== undefined)
+            model.set('cover_etag', conditional.digest(model.get('cover')));
+    },
 
     plays() {
         return this.hasMany('Play', 'game_id');
@@ -21,16 +33,7 @@ let Game = bookshelf.Model.extend({
         //mutators should be used, but I haven't found how to use them with bookshelf
         designers: {
             get () {
-                try {
-                    var data = this.get('json_designers');
-                    try {
-                        return JSON.parse(data);
-                    }catch(e){
-                        return data;
-                    }
-                }catch(e2){
-                    throw e2;
-                }
+                return this.parseJson('json_designers');
             },
             set: function(value) {
                 try {
@@ -45,10 +48,44 @@ let Game = bookshelf.Model.extend({
         links: function() {
             return {
                 'self': '/games/' + this.get('id'),
+                'cover': '/games/' + this.get('id') + '/cover',
+                'stats': '/games/' + this.get('id') + '/stats',
             };
         }
     },
 
+}, {
+    //every column but the base64 cover, which is too big to be read for lists and details
+    metadataColumns: ['id', 'name', 'json_designers', 'created_at', 'updated_at'],
+
+    //columns the lists can be ordered by
+    sortable: ['created_at', 'name'],
+
+    //fields for ?fields=, with the columns they are computed from
+    fields: {
+        id: ['id'],
+        name: ['name'],
+        designers: ['json_designers'],
+        created_at: ['created_at'],
+        updated_at: ['updated_at'],
+        links: ['id'],
+    },
+
+    //content types a cover is served with, anything else could be active content (html, svg with scripts)
+    coverTypes: ['image/png', 'image/gif', 'image/jpeg', 'image/webp'],
+
+    //splits a stored cover ("data:image/gif;base64,..." or plain base64) into content type and bytes
+    decodeCover(cover) {
+        let match = /^data:([^;,]*)(;base64)?,/.exec(cover);
+        if (!match)
+            return {type: 'application/octet-stream', data: Buffer.from(cover, 'base64')};
+        let payload = cover.substr(match[0].length);
+        let type = match[1].trim().toLowerCase();
+        return {
+            type: Game.coverTypes.indexOf(type) >= 0 ? type : 'application/octet-stream',
+            data: match[2] ? Buffer.from(payload, 'base64') : Buffer.from(decodeURIComponent(payload))
+        };
+    }
 });
 
 module.exports = bookshelf.model('Game', Game);
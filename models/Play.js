@@ -12,7 +12,8 @@ let Game = require('./Game');
 let Play = bookshelf.Model.extend({
     tableName: 'plays',
     hasTimestamps: true, //manage in automatic way created_at and updated_at
-    hidden: ['json_additional_data'], //hide from json deserialized
+    //hide from json deserialized, search_rank is only for ordering
+    hidden: ['json_additional_data', 'search_vector', 'search_rank'],
     user() {
         return this.belongsTo('User', 'user_id');
     },
@@ -24,16 +25,7 @@ let Play = bookshelf.Model.extend({
         //mutators should be used, but I haven't found how to use them with bookshelf
         additional_data: {
             get () {
-                try {
-                    var data = this.get('json_additional_data');
-                    try {
-                        return JSON.parse(data);
-                    }catch(e){
-                        return data;
-                    }
-                }catch(e2){
-                    throw e2;
-                }
+                return this.parseJson('json_additional_data');
             },
             set: function(value) {
                 try {
@@ -52,12 +44,29 @@ let Play = bookshelf.Model.extend({
                 'game': '/games/' + this.get('game_id'),
             };
             let additional_data = this.get('additional_data');
-            if('winner' in additional_data) {
+            if(additional_data && typeof additional_data == 'object' && 'winner' in additional_data) {
                 links['winner'] = '/users/' + additional_data['winner'];
             }
             return links;
         }
     },
+}, {
+    //columns the lists of a user can be ordered by, each one has an index starting with user_id
+    //that also gives the id order within equal values (see explain.js)
+    sortable: ['created_at', 'played_at', 'game_id'],
+
+    //fields for ?fields=, with the columns they are computed from
+    fields: {
+        id: ['id'],
+        name: ['name'],
+        played_at: ['played_at'],
+        user_id: ['user_id'],
+        game_id: ['game_id'],
+        additional_data: ['json_additional_data'],
+        created_at: ['created_at'],
+        updated_at: ['updated_at'],
+        links: ['id', 'user_id', 'game_id', 'json_additional_data'],
+    }
 });
 
 module.exports = bookshelf.model('Play', Play);
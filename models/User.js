@@ -2,7 +2,7 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
-let bcrypt = require('bcrypt-nodejs');
+let passwords = require('../lib/passwords');
 let bookshelf = require('../bookshelf');
 bookshelf.plugin('registry');
 let Play = require('./Play');//keep even if it is not used directly
@@ -19,24 +19,22 @@ let User = bookshelf.Model.extend({
     hashPassword: function(model, attrs, options) {
         let password = options.patch ? attrs.password : model.get('password');
         if (!password) { return; }
-        return new Promise(function(resolve, reject) {
-            bcrypt.genSalt(10, function(err, salt) {
-                bcrypt.hash(password, salt, null, function(err, hash) {
-                    if (options.patch) {
-                        attrs.password = hash;
-                    }
-                    model.set('password', hash);
-                    resolve();
-                });
-            });
+        return passwords.hash(password).then(function(hash) {
+            if (options.patch) {
+                attrs.password = hash;
+            }
+            model.set('password', hash);
         });
     },
 
     comparePassword: function(password, done) {
-        let model = this;
-        bcrypt.compare(password, model.get('password'), function(err, isMatch) {
-            done(err, isMatch);
-        });
+        passwords.compare(password, this.get('password'))
+            .then(isMatch => done(null, isMatch), err => done(err, false));
+    },
+
+    //true if the stored hash was made with a different cost than the configured one
+    needsRehash: function() {
+        return passwords.needsRehash(this.get('password'));
     },
 
     plays() {
@@ -50,9 +48,24 @@ let User = bookshelf.Model.extend({
             return {
                 'self': '/users/' + this.get('id'),
                 'plays': '/users/' + this.get('id') + '/plays',
+                'stats': '/users/' + this.get('id') + '/stats',
             };
         }
     }
+}, {
+    //columns the lists can be ordered by, name and email are unique so indexed
+    sortable: ['created_at', 'name', 'email'],
+
+    //fields for ?fields=, with the columns they are computed from
+    fields: {
+        id: ['id'],
+        name: ['name'],
+        email: ['email'],
+        role: ['role'],
+        created_at: ['created_at'],
+        updated_at: ['updated_at'],
+        links: ['id'],
+    }
 });
 
 module.exports = bookshelf.model('User', User);
@@ -0,0 +1,15 @@
+/**
+ * Recomputes the play_stats table from the plays, e.g. after a backfill or an import made outside the API.
+ * Usage: node rebuildStats.js
+ */
+"use strict";
+let knex = require('./db');
+let stats = require('./lib/stats');
+
+stats.rebuild(knex)
+    .then(rows=>console.log('Rebuilt ' + rows + ' statistics rows'))
+    .catch(err=>{
+        console.error(err);
+        process.exitCode = 1;
+    })
+    .then(()=>knex.destroy());
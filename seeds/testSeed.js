@@ -3,13 +3,16 @@
  */
 "use strict";
 let bcrypt = require('bcrypt-nodejs');
+let conditional = require('../lib/conditional');
+let stats = require('../lib/stats');
 
 exports.seed = function(knex, Promise) {
     return Promise.join(
         // Deletes ALL existing entries
         knex('users').del(),
         knex('games').del(),
-        knex('plays').del()
+        knex('plays').del(),
+        knex('play_stats').del()
         ).then(()=>{
             // Users
             return new Promise(function(resolve, reject) {
@@ -100,5 +103,12 @@ exports.seed = function(knex, Promise) {
                     updated_at: new Date()
                 })
             ])
-        });
+        })
+        //the games are inserted directly, not through models/Game.js that stores the cover ETag
+        .then(()=>knex('games').select('id', 'cover'))
+        .then(games=>Promise.all(games.map(game=>
+            knex('games').where('id', game.id).update({cover_etag: conditional.digest(game.cover)})
+        )))
+        //the plays are inserted directly, not through lib/stats.js
+        .then(()=>stats.rebuild(knex));
 };
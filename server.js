@@ -2,6 +2,7 @@
  * Created by claudio on 17/01/17.
  */
 "use strict";
+let context = require('./lib/context'); //first, it configures the promise library
 let express = require('express');
 let dotenv = require('dotenv');
 let logger = require('morgan');
@@ -9,15 +10,18 @@ let moment = require('moment');//keep even if it is not used directly
 var compression = require('compression');
 var bodyParser = require('body-parser');
 var expressValidator = require('express-validator');
-var jwt = require('jsonwebtoken');
-let User = require('./models/User');
-let config = require('./knexfile');
-let knex = require('knex')(config);
+let auth = require('./lib/auth');
+let metrics = require('./lib/metrics');
+let rateLimit = require('./lib/rateLimit');
+let responseCache = require('./lib/responseCache');
+let bookshelf = require('./bookshelf');
+let knex = bookshelf.knex;
 
 //controllers
 let user = require('./controllers/user');
 let game = require('./controllers/game');
 let play = require('./controllers/play');
+let stats = require('./controllers/stats');
 
 dotenv.load();
 let app = express();
@@ -25,29 +29,41 @@ let app = express();
 //config defaults
 //post body limit
 let requestLimit = process.env.REQUEST_LIMIT || 1024*1024*50; //50MB limit
+//admission control, per process
+let maxConcurrent = parseInt(process.env.MAX_CONCURRENT_REQUESTS) || 64;
+let maxQueue = parseInt(process.env.MAX_QUEUED_REQUESTS) || 512;
+let maxQueueWait = parseInt(process.env.MAX_QUEUE_WAIT) || 2000; //ms
+//rate limits, requests per second
+let loginRate = parseFloat(process.env.LOGIN_RATE_LIMIT) || 5; //per IP
+let signupRate = parseFloat(process.env.SIGNUP_RATE_LIMIT) || 1; //per IP
+let writeRate = parseFloat(process.env.WRITE_RATE_LIMIT) || 10; //per user
+let bulkRate = parseFloat(process.env.BULK_RATE_LIMIT) || 0.5; //per user
+
+//per request query counter and metrics
+context.watch(bookshelf.knex);
+app.use(context.middleware);
+app.use(metrics.middleware(context));
+
+//requests beyond the cap wait, and are rejected with 503 when the wait is too long
+app.use(rateLimit.admission({max: maxConcurrent, queue: maxQueue, wait: maxQueueWait, except: ['/metrics', '/status']}));
 
 //authentication
 app.use((req, res, next) => {
-    req.isAuthenticated = () => {
-        let token = (req.headers.authorization && req.headers.authorization.split(' ')[1]);// || req.cookies.token;
-        try {
-            return jwt.verify(token, process.env.TOKEN_SECRET);
-        } catch (err) {
-            return false;
-        }
-    };
+    let token = (req.headers.authorization && req.headers.authorization.split(' ')[1]);// || req.cookies.token;
+    let payload = auth.verifyToken(token);
+    req.isAuthenticated = () => payload;
 
-    if (req.isAuthenticated()) {
-        let payload = req.isAuthenticated();
-        new User({ id: payload.sub })
-            .fetch()
-            .then(function(user) {
-                req.user = user;
-                next();
-            });
-    } else {
-        next();
-    }
+    if (!payload)
+        return next();
+    auth.loadUser(payload.sub)
+        .then(function(user) {
+            req.user = user;
+            next();
+        })
+        .catch(err=>{
+            console.error(err);
+            res.status(500).send({msg: "Internal server Error"});
+        });
 });
 let ensureAuthenticated = (req, res, next) => {
     if (req.isAuthenticated() && req.user) {
@@ -57,11 +73,28 @@ let ensureAuthenticated = (req, res, next) => {
     }
 };
 
+//rate limits of the expensive routes, checked before the body is parsed
+let limits = {
+    login: rateLimit.limiter('login', {per: 'ip', rate: loginRate, burst: 50}), //bcrypt
+    signup: rateLimit.limiter('signup', {per: 'ip', rate: signupRate, burst: 50}), //bcrypt
+    write: rateLimit.limiter('write', {per: 'user', rate: writeRate, burst: 50}),
+    bulk: rateLimit.limiter('bulk', {per: 'user', rate: bulkRate, burst: 10}), //large bodies
+};
+app.post('/users/login', limits.login);
+app.post('/users/', limits.signup);
+app.put('/users/:id', limits.write);
+app.delete('/users/:id', limits.write);
+app.post('/games/', limits.write);
+app.post('/users/:userId/plays/', limits.write);
+app.post('/users/:userId/plays/bulk', limits.bulk);
+
 app.set('port', process.env.PORT || 3000);
 app.use(logger('dev'));
 app.use(bodyParser.json({limit:requestLimit, type:'application/json'}));
+app.use(bodyParser.text({limit:requestLimit, type:'application/x-ndjson'})); //bulk imports
 app.use(bodyParser.urlencoded({ extended:true,limit:requestLimit,type:'application/x-www-form-urlencoding' }));
 app.use(expressValidator());
+app.use(responseCache.middleware);//it stores compressed bodies, so it must come before compression
 app.use(compression());//gzip compression
 
 //routes
@@ -82,24 +115,49 @@ app.options('/users/:id',(req,res)=>res.set('Allow', 'GET,PUT,DELETE').status(20
 //games
 app.get('/games/', game.list);
 app.get('/games/:id', game.get);
+app.get('/games/:id/cover', game.cover);
+app.get('/games/:id/stats', stats.game);
 app.post('/games/', ensureAuthenticated, game.post);
 app.options('/games/',(req,res)=>res.set('Allow', 'GET,POST').status(200).send());
 app.options('/games/:id',(req,res)=>res.set('Allow', 'GET').status(200).send());
+app.options('/games/:id/cover',(req,res)=>res.set('Allow', 'GET').status(200).send());
+app.options('/games/:id/stats',(req,res)=>res.set('Allow', 'GET').status(200).send());
 
 //plays
 app.get('/users/:userId/plays/', play.userMiddleware, play.list);
 app.get('/users/:userId/plays/:id', play.userMiddleware, play.get);
 app.post('/users/:userId/plays/', ensureAuthenticated, play.userMiddleware, play.post);
+app.post('/users/:userId/plays/bulk', ensureAuthenticated, play.userMiddleware, play.bulk);
 app.options('/users/:userId/plays/',(req,res)=>res.set('Allow', 'GET,POST').status(200).send());
+app.options('/users/:userId/plays/bulk',(req,res)=>res.set('Allow', 'POST').status(200).send()); //this must be before :id version
 app.options('/users/:userId/plays/:id',(req,res)=>res.set('Allow', 'GET').status(200).send());
 
+//statistics
+app.get('/users/:userId/stats', play.userMiddleware, stats.user);
+app.options('/users/:userId/stats',(req,res)=>res.set('Allow', 'GET').status(200).send());
+
+//cache counters
+app.get('/status', (req, res)=>res.send({authCache: auth.stats(), responseCache: responseCache.stats()}));
+app.options('/status',(req,res)=>res.set('Allow', 'GET').status(200).send());
+
+//prometheus metrics
+app.get('/metrics', (req, res)=>metrics.render()
+    .then(text=>res.type('text/plain; version=0.0.4').send(text))
+    .catch(err=>{
+        console.error(err);
+        res.status(500).send({msg: "Internal server Error"});
+    }));
+app.options('/metrics',(req,res)=>res.set('Allow', 'GET').status(200).send());
+
 //needed just for tests
 app.delete('/clean', (req, res, next)=>{
     Promise.all([
         knex('users').del(),
         knex('games').del(),
-        knex('plays').del()
-    ]).then(()=>res.send('OK'));
+        knex('plays').del(),
+        knex('play_stats').del()
+    ]).then(()=>Promise.all([auth.clear(), responseCache.clear(), rateLimit.clear()]))
+        .then(()=>res.send('OK'));
 });
 
 //errors
@@ -114,8 +172,53 @@ app.delete('*', notImplemented);
 app.options('*', (req,res)=>res.set('Allow', '').status(200).send());
 
 
-app.listen(app.get('port'), function() {
+let server = app.listen(app.get('port'), function() {
     console.log('Express server listening on port ' + app.get('port'));
 });
 
+//graceful shutdown: stop accepting connections, finish the requests in flight, then close the pool
+let shutdownTimeout = parseInt(process.env.SHUTDOWN_TIMEOUT) || 30; //seconds before exiting anyway
+let closing = false;
+let sockets = new Map(); //socket -> requests in flight on it
+
+server.on('connection', socket => {
+    sockets.set(socket, 0);
+    socket.on('close', () => sockets.delete(socket));
+});
+server.prependListener('request', (req, res) => {
+    let socket = req.socket;
+    let done = false;
+    let finished = () => {
+        if (done)
+            return;
+        done = true;
+        sockets.set(socket, sockets.get(socket) - 1);
+        if (closing && !sockets.get(socket))
+            socket.end();
+    };
+    sockets.set(socket, sockets.get(socket) + 1);
+    if (closing)
+        res.setHeader('Connection', 'close');
+    res.on('finish', finished);
+    res.on('close', finished); //aborted by the client
+});
+
+let shutdown = () => {
+    if (closing)
+        return;
+    closing = true;
+    console.log('Shutting down, waiting for the requests in flight');
+    server.close(() => knex.destroy().then(() => process.exit(0)));
+    sockets.forEach((requests, socket) => {
+        if (!requests)
+            socket.end(); //idle keep-alive connection
+    });
+    setTimeout(() => {
+        console.error(`Requests still in flight after ${shutdownTimeout}s, exiting`);
+        process.exit(1);
+    }, shutdownTimeout * 1000).unref();
+};
+process.on('SIGTERM', shutdown);
+process.on('SIGINT', shutdown);
+
 module.exports = app;
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""
+Latency and throughput benchmark of the REST API.
+
+Seeds users, games and plays at the given scale, then drives a mixed
+read/write workload from many concurrent clients and prints, for every
+route, p50/p95/p99 latencies and requests per second as JSON.
+Save the output of two runs and pass one as --baseline to compare them.
+
+How to run (with the server started with RATE_LIMITS=off, all the requests
+come from one IP and the plays are written by one power user):
+    RATE_LIMITS=off npm start
+    cd test
+    python bench.py --users 200 --games 50 --plays 20 --clients 32 --duration 30 > run.json
+    python bench.py --no-seed --baseline run.json
+
+Requirements:
+    * Python 3
+    * Requests: http://docs.python-requests.org/en/master/
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from test import BASE_URL, UserTest, runSeeds
+
+# Route name -> weight in the mixed workload
+DEFAULT_MIX = {
+    'GET /games': 15,
+    'GET /games/:id': 15,
+    'GET /users/:id': 10,
+    'GET /users/:userId/plays': 25,
+    'GET /users/:userId/stats': 10,
+    'POST /users/:userId/plays': 20,
+    'POST /users/login': 5,
+}
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    values = sorted(values)
+    if not values:
+        return None
+    k = max(int(round(p / 100.0 * len(values))) - 1, 0)
+    return values[min(k, len(values) - 1)]
+
+def summary(latencies, elapsed):
+    """Count, requests per second and percentiles (ms) of a list of latencies."""
+    return {
+        'count': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+def created(res, what):
+    """The JSON body of a 201 response, stops the benchmark with the reason otherwise."""
+    if res.status_code == 429:
+        raise SystemExit('Creating {}: 429, start the server with RATE_LIMITS=off'.format(what))
+    if res.status_code != 201:
+        raise SystemExit('Creating {}: {} {}'.format(what, res.status_code, res.text))
+    return res.json()
+
+def seed(users, games, plays, clients):
+    """Resets the database and creates the fixtures. Returns (user ids, game ids, power user headers)."""
+    runSeeds()
+    power = UserTest.loginAs('poweruser1@test.com', 'test')
+
+    def create_user(i):
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name': 'bench{}'.format(i), 'email': 'bench{}@test.com'.format(i), 'password': '12345'})
+        return created(res, 'user {}'.format(i))['id']
+
+    def create_game(i):
+        res = requests.post('{}/games'.format(BASE_URL), json = {'name': 'Bench game {}'.format(i), 'designers': ['designer{}'.format(i % 7)], 'cover': 'imagedata'}, headers=power)
+        return created(res, 'game {}'.format(i))['id']
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        user_ids = list(pool.map(create_user, range(users)))
+        game_ids = list(pool.map(create_game, range(games)))
+
+        def create_plays(user_id):
+            rows = [{'name': 'Bench play {}'.format(i),
+                     'additional_data': {'winner': random.choice(user_ids)},
+                     'played_at': 1480000000 + i * 3600,
+                     'game_id': random.choice(game_ids)} for i in range(plays)]
+            if rows:
+                res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, user_id), json = rows, headers=power)
+                created(res, 'plays of user {}'.format(user_id))
+        list(pool.map(create_plays, user_ids))
+    return user_ids, game_ids, power
+
+def existing_fixtures():
+    """Reads the ids of an already seeded database."""
+    user_ids = [u['id'] for u in requests.get('{}/users'.format(BASE_URL), params={'limit': 100}).json()]
+    game_ids = [g['id'] for g in requests.get('{}/games'.format(BASE_URL), params={'limit': 100}).json()]
+    return user_ids, game_ids, UserTest.loginAs('poweruser1@test.com', 'test')
+
+def request(session, route, user_ids, game_ids, power):
+    """Runs one request of the given route on random fixtures."""
+    user_id = random.choice(user_ids)
+    game_id = random.choice(game_ids)
+    if route == 'GET /games':
+        return session.get('{}/games'.format(BASE_URL))
+    if route == 'GET /games/:id':
+        return session.get('{}/games/{}'.format(BASE_URL, game_id))
+    if route == 'GET /users/:id':
+        return session.get('{}/users/{}'.format(BASE_URL, user_id))
+    if route == 'GET /users/:userId/plays':
+        return session.get('{}/users/{}/plays'.format(BASE_URL, user_id))
+    if route == 'GET /users/:userId/stats':
+        return session.get('{}/users/{}/stats'.format(BASE_URL, user_id))
+    if route == 'POST /users/:userId/plays':
+        return session.post('{}/users/{}/plays'.format(BASE_URL, user_id),
+                            json = {'name': 'Bench', 'additional_data': {'winner': user_id}, 'played_at': int(time.time()), 'game_id': game_id},
+                            headers=power)
+    if route == 'POST /users/login':
+        return session.post('{}/users/login'.format(BASE_URL), json = {'email': 'poweruser1@test.com', 'password': 'test'})
+    raise ValueError('Unknown route ' + route)
+
+def run(mix, clients, duration, user_ids, game_ids, power):
+    """Drives the workload for duration seconds. Returns the report."""
+    routes = list(mix.keys())
+    weights = [mix[r] for r in routes]
+    latencies = dict((r, []) for r in routes)
+    errors = dict((r, 0) for r in routes)
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(_):
+        session = requests.Session()
+        while time.time() < deadline:
+            route = random.choices(routes, weights)[0]
+            start = time.time()
+            try:
+                res = request(session, route, user_ids, game_ids, power)
+                ok = res.status_code < 400
+            except requests.RequestException:
+                ok = False
+            latency = (time.time() - start) * 1000
+            with lock:
+                if ok:
+                    latencies[route].append(latency)
+                else:
+                    errors[route] += 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.time() - start
+
+    report = {'clients': clients, 'duration_s': elapsed, 'routes': {}}
+    for route in routes:
+        report['routes'][route] = summary(latencies[route], elapsed)
+        report['routes'][route]['errors'] = errors[route]
+    report['total'] = summary([l for r in routes for l in latencies[r]], elapsed)
+    return report
+
+def compare(report, baseline):
+    """Ratio current/baseline of rps and p99 for every route of both reports."""
+    result = {}
+    for route, current in report['routes'].items():
+        old = baseline.get('routes', {}).get(route)
+        if old and old['p99_ms'] and old['rps'] and current['p99_ms'] is not None:
+            result[route] = {'rps_ratio': current['rps'] / old['rps'], 'p99_ratio': current['p99_ms'] / old['p99_ms']}
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='users to create')
+    parser.add_argument('--games', type=int, default=20, help='games to create')
+    parser.add_argument('--plays', type=int, default=20, help='plays to create for every user')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of workload')
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_MIX, help='JSON object route -> weight')
+    parser.add_argument('--no-seed', action='store_true', help='use the data already in the database')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    args = parser.parse_args()
+
+    if args.no_seed:
+        user_ids, game_ids, power = existing_fixtures()
+    else:
+        user_ids, game_ids, power = seed(args.users, args.games, args.plays, args.clients)
+
+    report = run(args.mix, args.clients, args.duration, user_ids, game_ids, power)
+    report['scale'] = {'users': len(user_ids), 'games': len(game_ids), 'plays_per_user': None if args.no_seed else args.plays}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['baseline'] = compare(report, json.load(f))
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Concurrent login load test: measures POST /users/login latency while many
+clients log in at the same time, and checks that other requests stay fast.
+
+How to run (with the server started):
+    cd test
+    python login_load.py --clients 32 --requests 256
+
+Requirements:
+    * Python 3
+    * Requests: http://docs.python-requests.org/en/master/
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import summary
+from test import BASE_URL, runSeeds
+
+def login(session):
+    """Logs in as the seeded power user, returns (latency in ms, status code)."""
+    start = time.time()
+    res = session.post('{}/users/login'.format(BASE_URL), json = {'email': 'poweruser1@test.com', 'password': 'test'})
+    return (time.time() - start) * 1000, res.status_code
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=256, help='total login requests')
+    parser.add_argument('--no-seeds', action='store_true', help='do not reset the database first')
+    args = parser.parse_args()
+
+    if not args.no_seeds:
+        runSeeds()
+
+    local = threading.local()
+    def run(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return login(local.session)
+
+    # Probe a cheap route while the logins run to see if the event loop is blocked
+    probes = []
+    done = threading.Event()
+    def probe():
+        session = requests.Session()
+        while not done.is_set():
+            start = time.time()
+            session.get('{}/games/1'.format(BASE_URL))
+            probes.append((time.time() - start) * 1000)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(run, range(args.requests)))
+    elapsed = time.time() - start
+    done.set()
+    prober.join()
+
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report = {
+        'clients': args.clients,
+        'login': summary([l for l, status in results if status == 200], elapsed),
+        'statuses': statuses,
+        'probe_get_game': summary(probes, elapsed),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Runs the test classes of test.py in parallel, each worker with its own server
+and sqlite database.
+
+The database is migrated and seeded once into a snapshot; every worker starts
+`node server.js` on its own port with a copy of the snapshot, and runSeeds()
+restores the copy from the snapshot instead of running the seeds again.
+
+How to run (from the repository root, no server needs to be started):
+    python test/parallel.py --workers 3 --verbose
+
+Requirements:
+    * Python 3.7+
+    * Requests: http://docs.python-requests.org/en/master/
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import requests
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+
+def test_classes():
+    """Names of the classes of test.py that contain tests."""
+    sys.path.insert(0, TEST_DIR)
+    import test
+    loader = unittest.TestLoader()
+    return [name for name in dir(test)
+            if isinstance(getattr(test, name), type) and issubclass(getattr(test, name), unittest.TestCase)
+            and loader.getTestCaseNames(getattr(test, name))]
+
+def make_snapshot(directory):
+    """Migrates and seeds a new sqlite database. Returns its path."""
+    snapshot = os.path.join(directory, 'snapshot.sqlite3')
+    env = dict(os.environ, SQLITE_FILENAME=snapshot)
+    env.pop('DATABASE_URL', None)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.run(['npm', 'run', 'seeds'], cwd=ROOT_DIR, env=env, stdout=devnull, check=True)
+    return snapshot
+
+def start_server(port, database):
+    """Starts a server on port using database, waits until it answers."""
+    env = dict(os.environ, PORT=str(port), SQLITE_FILENAME=database)
+    env.pop('DATABASE_URL', None)
+    server = subprocess.Popen(['node', 'server.js'], cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get('http://localhost:{}/games'.format(port))
+            return server
+        except requests.ConnectionError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('Server on port {} did not start'.format(port))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel servers (at most one per test class)')
+    parser.add_argument('--port', type=int, default=4000, help='port of the first server')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    classes = test_classes()
+    workers = max(min(args.workers, len(classes)), 1)
+    groups = [classes[i::workers] for i in range(workers)]
+
+    directory = tempfile.mkdtemp(prefix='board-rest-tests-')
+    servers = []
+    try:
+        snapshot = make_snapshot(directory)
+        runs = []
+        for i, group in enumerate(groups):
+            port = args.port + i
+            database = os.path.join(directory, 'worker{}.sqlite3'.format(i))
+            shutil.copy(snapshot, database)
+            servers.append(start_server(port, database))
+            env = dict(os.environ,
+                       BOARD_REST_URL='http://localhost:{}'.format(port),
+                       SEED_SNAPSHOT=snapshot,
+                       SQLITE_FILENAME=database,
+                       PYTHONPATH=TEST_DIR)
+            command = [sys.executable, '-m', 'unittest'] + (['-v'] if args.verbose else []) + ['test.' + name for name in group]
+            runs.append((group, subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)))
+
+        failed = False
+        for group, run in runs:
+            output, _ = run.communicate()
+            print('==== {} ===='.format(', '.join(group)))
+            print(output)
+            failed = failed or run.returncode != 0
+        return 1 if failed else 0
+    finally:
+        for server in servers:
+            server.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
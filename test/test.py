@@ -10,19 +10,36 @@ Requirements:
     * Requests: http://docs.python-requests.org/en/master/
 """
 
+import base64
 import requests
 import unittest
 import subprocess
 import datetime
 import os
+import sqlite3
+import threading
+import json
 
-BASE_URL = 'http://localhost:3000'
+BASE_URL = os.environ.get('BOARD_REST_URL', 'http://localhost:3000')
 
 def runSeeds():
     """Run seeds to reset the database"""
+    requests.delete('{}/clean'.format(BASE_URL)) # also empties the server caches
+    if os.environ.get('SEED_SNAPSHOT'):
+        return restoreSnapshot(os.environ['SEED_SNAPSHOT'], os.environ['SQLITE_FILENAME'])
     with open(os.devnull, 'w') as devnull:
         subprocess.run(["npm", "run", "seeds"], stdout=devnull)
 
+def restoreSnapshot(snapshot, database):
+    """Reset the sqlite database of the server by copying a seeded snapshot into it (see parallel.py)"""
+    source = sqlite3.connect(snapshot)
+    target = sqlite3.connect(database, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
 def get_options_verbs(url):
     """Performs an OPTIONS HTTP request on the given URL and gives the list of allowed HTTP verbs."""
     res = requests.options(url)
@@ -166,7 +183,7 @@ class UserTest(RestTest):
     def test_user_list(self):
         """Checks on the length of the user list."""
         # Checking the list of users
-        res = requests.get('{}/users'.format(BASE_URL))
+        res = requests.get('{}/users'.format(BASE_URL), params={'limit': 100})
         self.assertEqual(res.status_code, 200)
         self.assertGreaterEqual(len(res.json()), 1)
         numUsers = len(res.json())
@@ -177,10 +194,103 @@ class UserTest(RestTest):
             self.assertEqual(res.status_code, 201)
 
         # Checking the list of users
-        res = requests.get('{}/users'.format(BASE_URL))
+        res = requests.get('{}/users'.format(BASE_URL), params={'limit': 100})
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.json()), numUsers+2)
 
+    def test_user_list_pagination(self):
+        """Walks the user list page by page while users are being created. Expected: every row exactly once"""
+        for i in range(7):
+            res = requests.post('{}/users'.format(BASE_URL), json = {'name':'page{}'.format(i), 'email': 'page{}@middleware.polimi'.format(i), 'password': '12345'})
+            self.assertEqual(res.status_code, 201)
+        existing = set(u['id'] for u in requests.get('{}/users'.format(BASE_URL), params={'limit': 100}).json())
+
+        # Create other users concurrently
+        def insert():
+            for i in range(5):
+                requests.post('{}/users'.format(BASE_URL), json = {'name':'concurrent{}'.format(i), 'email': 'concurrent{}@middleware.polimi'.format(i), 'password': '12345'})
+        inserter = threading.Thread(target=insert)
+        inserter.start()
+
+        seen = []
+        url = '{}/users?limit=2&order=created_at'.format(BASE_URL)
+        while url:
+            res = requests.get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(res.json()), 2)
+            seen.extend(u['id'] for u in res.json())
+            url = BASE_URL + res.links['next']['url'] if 'next' in res.links else None
+        inserter.join()
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertTrue(existing.issubset(set(seen)))
+
+    def test_user_list_invalid_cursor(self):
+        """Uses a cursor that was not produced by the server. Expected: 422"""
+        res = requests.get('{}/users'.format(BASE_URL), params={'cursor': 'invalid'})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.json()[0]['param'], 'cursor')
+
+        # well formed, but the value or the id can't be compared with the columns
+        for values in [['created_at', 'asc', {'a': 1}, 1], ['created_at', 'asc', None, 1], ['created_at', 'asc', 0, '1 OR 1']]:
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            res = requests.get('{}/users'.format(BASE_URL), params={'cursor': cursor})
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(res.json()[0]['param'], 'cursor')
+
+    def test_conditional_get_user(self):
+        """GET a user again with its validators. Expected: 304 for If-None-Match and If-Modified-Since"""
+        url = '{}/users/{}'.format(BASE_URL, UserTest.initial_user_id)
+        res = requests.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers['ETag'].startswith('W/'))
+
+        res2 = requests.get(url, headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res2.status_code, 304)
+        self.assertEqual(res2.content, b'')
+        res2 = requests.get(url, headers={'If-Modified-Since': res.headers['Last-Modified']})
+        self.assertEqual(res2.status_code, 304)
+        res2 = requests.get(url, headers={'If-None-Match': 'W/"other"'})
+        self.assertEqual(res2.status_code, 200)
+
+    def test_put_user_if_match(self):
+        """PUT a user with a stale ETag, then with the current one. Expected: 412, then 200"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'if_match', 'email': 'if_match@middleware.polimi', 'password': '12345'})
+        self.assertEqual(res.status_code, 201)
+        url = '{}/users/{}'.format(BASE_URL, res.json()['id'])
+        headers = self.loginAs('if_match@middleware.polimi', '12345')
+        etag = requests.get(url).headers['ETag']
+
+        # Another client modifies the user
+        res = requests.put(url, json = {'name':'if_match2', 'email': 'if_match2@middleware.polimi', 'password': '12345'}, headers=headers)
+        self.assertEqual(res.status_code, 200)
+
+        res = requests.put(url, json = {'name':'if_match3', 'email': 'if_match3@middleware.polimi', 'password': '12345'}, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(res.status_code, 412)
+
+        etag = requests.get(url).headers['ETag']
+        res = requests.put(url, json = {'name':'if_match3', 'email': 'if_match3@middleware.polimi', 'password': '12345'}, headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['name'], 'if_match3')
+
+    def test_concurrent_put_user_if_match(self):
+        """Two PUTs at the same time with the same ETag. Expected: one 200 and one 412"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'race', 'email': 'race@middleware.polimi', 'password': '12345'})
+        self.assertEqual(res.status_code, 201)
+        url = '{}/users/{}'.format(BASE_URL, res.json()['id'])
+        headers = dict(self.loginAs('race@middleware.polimi', '12345'), **{'If-Match': requests.get(url).headers['ETag']})
+
+        statuses = []
+        def put(i):
+            res = requests.put(url, json = {'name':'race{}'.format(i), 'email': 'race{}@middleware.polimi'.format(i), 'password': '12345'}, headers=headers)
+            statuses.append(res.status_code)
+        writers = [threading.Thread(target=put, args=(i,)) for i in range(2)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(sorted(statuses), [200, 412])
+
     def test_invalid_email(self):
         """Try to create an user with an invalid email. Expected: 401"""
         res = requests.post('{}/users'.format(BASE_URL), json = {'name':'invalid_email_user', 'email': 'invalid_email', 'password': '12345'})
@@ -242,6 +352,16 @@ class UserTest(RestTest):
         res = requests.put('{}/users/{}'.format(BASE_URL, user_id), json = {'name':'zombie2', 'email': 'zombie2@email.com', 'password': 'secret'}, headers = uHeaders)
         self.assertEqual(res.status_code, 401)
 
+    def test_auth_cache_counters(self):
+        """Repeated authenticated requests are served from the auth cache. Expected: hit counters increase"""
+        requests.get('{}/users/{}'.format(BASE_URL, UserTest.initial_user_id), headers = UserTest.headersObj)
+        before = requests.get('{}/status'.format(BASE_URL)).json()['authCache']
+        res = requests.get('{}/users/{}'.format(BASE_URL, UserTest.initial_user_id), headers = UserTest.headersObj)
+        self.assertEqual(res.status_code, 200)
+        after = requests.get('{}/status'.format(BASE_URL)).json()['authCache']
+        self.assertEqual(after['tokens']['hits'], before['tokens']['hits'] + 1)
+        self.assertEqual(after['users']['hits'], before['users']['hits'] + 1)
+
     def test_expired_token_login(self):
         """An expired token is used to attempt an action from a logged in user. Expected: 401"""
         expiredToken = self.getExpiredToken(UserTest.initial_user_id)
@@ -304,6 +424,112 @@ class GameTest(RestTest):
         self.assertEqual(res.status_code, 200)
         self.assertGreaterEqual(len(res.json()), 1)
 
+    def test_game_cover(self):
+        """Covers are not embedded in game resources and are served as binary with an ETag. Expected: 200, then 304"""
+        res = requests.get('{}/games'.format(BASE_URL))
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse('cover' in res.json()[0])
+        cover_url = res.json()[0]['links']['cover']
+
+        res = requests.get('{}{}'.format(BASE_URL, cover_url))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Type'], 'image/gif')
+        self.assertEqual(res.content[:6], b'GIF89a')
+        etag = res.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        res = requests.get('{}{}'.format(BASE_URL, cover_url), headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_game_cover_not_image(self):
+        """A cover that is not an image is served as bytes only. Expected: application/octet-stream, nosniff"""
+        headersObj = UserTest.loginAs('poweruser1@test.com', 'test')
+        res = requests.post('{}/games'.format(BASE_URL), json = {'name':'Html', 'designers': ['h'], 'cover': 'data:text/html,<script>alert(1)</script>'}, headers=headersObj)
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse('cover_etag' in res.json())
+        cover_url = res.json()['links']['cover']
+
+        res = requests.get('{}{}'.format(BASE_URL, cover_url))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Type'], 'application/octet-stream')
+        self.assertEqual(res.headers['X-Content-Type-Options'], 'nosniff')
+        etag = res.headers['ETag']
+
+        res = requests.get('{}{}'.format(BASE_URL, cover_url), headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_game_fields(self):
+        """Asks for some fields of games. Expected: only those fields, 422 for unknown ones"""
+        res = requests.get('{}/games'.format(BASE_URL), params={'fields': 'id,links'})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(sorted(g.keys()) == ['id', 'links'] for g in res.json()))
+        self.assertEqual(res.json()[0]['links']['self'], '/games/{}'.format(res.json()[0]['id']))
+
+        res = requests.get('{}/games/{}'.format(BASE_URL, res.json()[0]['id']), params={'fields': 'name,designers'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(res.json().keys()), ['designers', 'name'])
+
+        res = requests.get('{}/games'.format(BASE_URL), params={'fields': 'id,cover'})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.json()[0]['param'], 'fields')
+
+    def test_search_games(self):
+        """Searches games by name and designer. Expected: only the matching games"""
+        headersObj = UserTest.loginAs('poweruser1@test.com', 'test')
+        res = requests.post('{}/games'.format(BASE_URL), json = {'name':'Zanzibar Traders', 'designers': ['Quetzal Smith'], 'cover': 'imagedata'}, headers=headersObj)
+        self.assertEqual(res.status_code, 201)
+        game_id = res.json()['id']
+
+        for search in ['zanzibar', 'Zanz', 'quetzal', 'traders zanzibar']:
+            res = requests.get('{}/games'.format(BASE_URL), params={'search': search})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([g['id'] for g in res.json()], [game_id])
+            self.assertFalse('search_rank' in res.json()[0])
+
+        res = requests.get('{}/games'.format(BASE_URL), params={'search': 'zanzibar nothing'})
+        self.assertEqual(res.json(), [])
+
+    def test_metrics(self):
+        """Metrics are exposed in the Prometheus format. Expected: request histograms labelled by route"""
+        requests.get('{}/games'.format(BASE_URL))
+        res = requests.get('{}/metrics'.format(BASE_URL))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers['Content-Type'].startswith('text/plain'))
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/games/",status="200"}', res.text)
+        self.assertIn('http_request_db_queries_bucket{route="/games/",le="1"}', res.text)
+        self.assertIn('nodejs_eventloop_lag_seconds{quantile="0.99"}', res.text)
+
+    def test_response_cache(self):
+        """Game responses are cached until a game is created. Expected: MISS, HIT, then MISS with the new game"""
+        url = '{}/games'.format(BASE_URL)
+        res = requests.get(url, params={'limit': 100})
+        res = requests.get(url, params={'limit': 100})
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(res.headers['X-Query-Count'], '0')
+        ids = [g['id'] for g in res.json()]
+
+        headersObj = UserTest.loginAs('poweruser1@test.com', 'test')
+        res = requests.post(url, json = {'name':'Cached', 'designers': ['e'], 'cover': 'imagedata'}, headers=headersObj)
+        self.assertEqual(res.status_code, 201)
+        game_id = res.json()['id']
+
+        res = requests.get(url, params={'limit': 100})
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual([g['id'] for g in res.json()], ids + [game_id])
+
+        res = requests.get(url, params={'limit': 100}, headers={'Accept': 'application/x-ndjson'})
+        self.assertFalse('X-Cache' in res.headers)
+        self.assertEqual(len(res.text.strip().split('\n')), len(ids) + 1)
+        res = requests.get(url, params={'limit': 100})
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(res.json()[-1]['id'], game_id)
+
+        res = requests.get('{}/{}'.format(url, game_id))
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        res2 = requests.get('{}/{}'.format(url, game_id))
+        self.assertEqual(res2.headers['X-Cache'], 'HIT')
+        self.assertEqual(res2.json(), res.json())
+
     def test_game_list_options(self):
         """OPTIONS on /games should return GET, POST"""
         verbs = get_options_verbs('{}/games'.format(BASE_URL))
@@ -455,6 +681,264 @@ class PlayTest(RestTest):
         for i in range(len(res.json())-1):
             self.assertLess(res.json()[i]['game_id'], res.json()[i+1]['game_id'])
 
+    def test_bulk_import(self):
+        """Imports plays from a JSON array and from NDJSON. Expected: 201, all plays listed"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'bulk_user', 'email': 'bulk_user@test.com', 'password': '12345'})
+        bulk_user_id = res.json()['id']
+        headers = UserTest.loginAs('bulk_user@test.com', '12345')
+        plays = [{'name': 'Bulk{}'.format(i), 'additional_data': {'i': i}, 'played_at': PlayTest.timestamp + i, 'game_id': PlayTest.game_id} for i in range(150)]
+
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), json = plays[:100], headers=headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['count'], 100)
+
+        ndjson = '\n'.join(json.dumps(play) for play in plays[100:])
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), data = ndjson,
+                            headers=dict(headers, **{'Content-Type': 'application/x-ndjson'}))
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['count'], 50)
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, bulk_user_id), params={'limit': 100, 'order': 'played_at'})
+        self.assertEqual(len(res.json()), 100)
+        self.assertEqual(res.json()[99]['additional_data'], {'i': 99})
+
+    def test_stream_plays(self):
+        """Streams a long play list as NDJSON. Expected: every play once, in order, with its virtuals"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'stream_user', 'email': 'stream_user@test.com', 'password': '12345'})
+        stream_user_id = res.json()['id']
+        headers = UserTest.loginAs('stream_user@test.com', '12345')
+        plays = [{'name': 'Stream{}'.format(i), 'additional_data': {'winner': stream_user_id}, 'played_at': PlayTest.timestamp + i, 'game_id': PlayTest.game_id} for i in range(1100)]
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, stream_user_id), json = plays, headers=headers)
+        self.assertEqual(res.status_code, 201)
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, stream_user_id), params={'order': 'played_at'},
+                           headers={'Accept': 'application/x-ndjson'}, stream=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers['Content-Type'].startswith('application/x-ndjson'))
+        self.assertIn('Accept', res.headers['Vary'])
+        rows = [json.loads(line) for line in res.iter_lines() if line]
+        self.assertEqual([r['name'] for r in rows], [p['name'] for p in plays])
+        self.assertEqual(rows[0]['links']['winner'], '/users/{}'.format(stream_user_id))
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, stream_user_id), params={'stream': 1, 'search': 'stream1099'})
+        self.assertEqual([json.loads(line)['name'] for line in res.text.splitlines()], ['Stream1099'])
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, stream_user_id), params={'search': 'stream1099'})
+        self.assertIn('Accept', res.headers['Vary'])
+
+    def test_bulk_import_invalid_rows(self):
+        """Imports plays where some rows are invalid. Expected: 422 with the row numbers, nothing inserted"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'bulk_invalid', 'email': 'bulk_invalid@test.com', 'password': '12345'})
+        bulk_user_id = res.json()['id']
+        headers = UserTest.loginAs('bulk_invalid@test.com', '12345')
+        plays = [
+            {'name': 'Ok', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id},
+            {'name': 'NoGame', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp, 'game_id': -1},
+            {'name': '', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id},
+        ]
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), json = plays, headers=headers)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([(e['row'], e['param']) for e in res.json()], [(2, 'name')])
+
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), json = plays[:2], headers=headers)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([(e['row'], e['param']) for e in res.json()], [(1, 'game_id')])
+
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), json = [None], headers=headers)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([(e['row'], e['msg']) for e in res.json()], [(0, 'Row must be an object')])
+
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, bulk_user_id), data = 'null\n{',
+                            headers=dict(headers, **{'Content-Type': 'application/x-ndjson'}))
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([(e['row'], e['msg']) for e in res.json()], [(1, 'Row is not valid JSON'), (0, 'Row must be an object')])
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, bulk_user_id))
+        self.assertEqual(len(res.json()), 0)
+
+    def test_search_plays(self):
+        """Searches the plays of a user by name and additional data. Expected: only the matching plays"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'search_user', 'email': 'search_user@test.com', 'password': '12345'})
+        search_user_id = res.json()['id']
+        headers = UserTest.loginAs('search_user@test.com', '12345')
+        for name, data in [('Friday night', {'notes': 'kingmaker'}), ('Saturday', {'notes': 'close game'})]:
+            res = requests.post('{}/users/{}/plays'.format(BASE_URL, search_user_id),
+                                json = {'name': name, 'additional_data': data, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id}, headers=headers)
+            self.assertEqual(res.status_code, 201)
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, search_user_id), params={'search': 'kingmaker'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([p['name'] for p in res.json()], ['Friday night'])
+        self.assertFalse('search_rank' in res.json()[0])
+
+        res = requests.get('{}/users/{}/plays'.format(BASE_URL, search_user_id), params={'search': 'saturday'})
+        self.assertEqual([p['name'] for p in res.json()], ['Saturday'])
+
+    def test_seeded_play_stats(self):
+        """Statistics of the seeded user, whose plays were inserted by the seed. Expected: the same number of plays, the seeded wins"""
+        plays = requests.get('{}/users/1/plays'.format(BASE_URL), params={'limit': 100})
+        self.assertEqual(plays.status_code, 200)
+        res = requests.get('{}/users/1/stats'.format(BASE_URL))
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(res.json()['plays'], 2)
+        self.assertEqual(res.json()['plays'], len(plays.json()))
+        self.assertGreaterEqual(res.json()['wins'], 2)
+
+    def test_play_stats(self):
+        """Statistics follow single and bulk play creation. Expected: counts of plays and wins per game"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'stats_user', 'email': 'stats_user@test.com', 'password': '12345'})
+        stats_user_id = res.json()['id']
+        headers = UserTest.loginAs('stats_user@test.com', '12345')
+
+        res = requests.get('{}/users/{}/stats'.format(BASE_URL, stats_user_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['plays'], 0)
+        res = requests.get('{}/games/{}/stats'.format(BASE_URL, PlayTest.game_id))
+        self.assertEqual(res.status_code, 200)
+        game_plays = res.json()['plays']
+
+        res = requests.post('{}/users/{}/plays'.format(BASE_URL, stats_user_id),
+                            json = {'name': 'Won', 'additional_data': {'winner': stats_user_id}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        plays = [{'name': 'Lost{}'.format(i), 'additional_data': {'winner': PlayTest.user_id}, 'played_at': PlayTest.timestamp + 10 + i, 'game_id': PlayTest.game_id} for i in range(2)]
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, stats_user_id), json = plays, headers=headers)
+        self.assertEqual(res.status_code, 201)
+
+        res = requests.get('{}/users/{}/stats'.format(BASE_URL, stats_user_id))
+        self.assertEqual(res.json()['plays'], 3)
+        self.assertEqual(res.json()['wins'], 1)
+        self.assertEqual(res.json()['last_played_at'], PlayTest.timestamp + 11)
+        self.assertEqual([(g['game_id'], g['plays'], g['wins']) for g in res.json()['games']], [(PlayTest.game_id, 3, 1)])
+
+        res = requests.get('{}/games/{}/stats'.format(BASE_URL, PlayTest.game_id))
+        self.assertEqual(res.json()['plays'], game_plays + 3)
+        game_wins = res.json()['wins']
+
+        # like a rebuild, no wins for a winner that is not a user
+        plays = [{'name': 'Ghost', 'additional_data': {'winner': 999999999}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id}]
+        res = requests.post('{}/users/{}/plays/bulk'.format(BASE_URL, stats_user_id), json = plays, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        res = requests.get('{}/games/{}/stats'.format(BASE_URL, PlayTest.game_id))
+        self.assertEqual((res.json()['plays'], res.json()['wins']), (game_plays + 4, game_wins))
+
+        res = requests.get('{}/users/-1/stats'.format(BASE_URL))
+        self.assertEqual(res.status_code, 404)
+
+    def test_play_list_single_query(self):
+        """Lists plays, with and without their games. Expected: one database query per request"""
+        res = requests.post('{}/users/{}/plays'.format(BASE_URL, PlayTest.user_id),
+                            json = {'name': 'Counted', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id},
+                            headers=UserTest.loginAs('play_user@test.com', '12345'))
+        self.assertEqual(res.status_code, 201)
+
+        url = '{}/users/{}/plays'.format(BASE_URL, PlayTest.user_id)
+        requests.get(url) # loads the owner in the user cache
+        res = requests.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Query-Count'], '1')
+
+        res = requests.get(url, params={'include': 'game'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Query-Count'], '1')
+        self.assertTrue(all(p['game']['id'] == p['game_id'] and p['game']['name'] for p in res.json()))
+
+    def test_play_fields(self):
+        """Lists plays with some fields, with and without their games. Expected: only those fields, pagination works"""
+        url = '{}/users/{}/plays'.format(BASE_URL, PlayTest.user_id)
+        for i in range(3):
+            res = requests.post(url, json = {'name': 'Fields {}'.format(i), 'additional_data': {'winner': PlayTest.user_id}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id},
+                                headers=PlayTest.headersObj)
+            self.assertEqual(res.status_code, 201)
+
+        res = requests.get(url, params={'fields': 'name,links', 'limit': 2, 'order': 'played_at'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()), 2)
+        self.assertTrue(all(sorted(p.keys()) == ['links', 'name'] for p in res.json()))
+        self.assertTrue('next' in res.links)
+        res = requests.get('{}{}'.format(BASE_URL, res.links['next']['url']))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(sorted(p.keys()) == ['links', 'name'] for p in res.json()))
+
+        res = requests.get(url, params={'fields': 'id,game', 'include': 'game'})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(sorted(p.keys()) == ['game', 'id'] and p['game']['name'] for p in res.json()))
+
+        res = requests.get(url, params={'fields': 'id,game'})
+        self.assertEqual(res.status_code, 422)
+
+    def test_rate_limited_writes(self):
+        """Imports plays as fast as possible. Expected: 429 with Retry-After once the burst is used"""
+        requests.post('{}/users'.format(BASE_URL), json = {'name':'limited_user', 'email': 'limited_user@test.com', 'password': '12345'})
+        headers = UserTest.loginAs('limited_user@test.com', '12345')
+        user_id = requests.get('{}/users'.format(BASE_URL), params={'search': 'limited_user'}).json()[0]['id']
+        url = '{}/users/{}/plays/bulk'.format(BASE_URL, user_id)
+
+        # bursts of 10 refilled at 0.5/s: the limit is reached even if every request takes a second
+        statuses = []
+        for i in range(100):
+            res = requests.post(url, json = [], headers=headers)
+            statuses.append(res.status_code)
+            if res.status_code == 429:
+                break
+        self.assertEqual(statuses[0], 422)
+        self.assertEqual(statuses[-1], 429)
+        self.assertGreaterEqual(int(res.headers['Retry-After']), 1)
+
+    def test_play_queries_use_indexes(self):
+        """Explains the main play list queries with explain.js. Expected: no full scan of plays, no sort on sqlite"""
+        out = json.loads(subprocess.check_output(["node", "explain.js"], universal_newlines=True))
+        self.assertGreater(len(out['queries']), 0)
+        for name, query in out['queries'].items():
+            self.assertFalse(query['fullScan'], '{} scans plays: {}'.format(name, query['plan']))
+            if out['client'] != 'pg':
+                self.assertFalse(query['sort'], '{} sorts: {}'.format(name, query['plan']))
+
+    def test_play_list_typed_filters(self):
+        """Filters plays by game and date with integers, orders by a column. Expected: exact matches, 422 for bad values"""
+        url = '{}/users/{}/plays'.format(BASE_URL, PlayTest.user_id)
+        res = requests.post(url, json = {'name': 'Typed', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp + 5000, 'game_id': PlayTest.game_id},
+                            headers=PlayTest.headersObj)
+        self.assertEqual(res.status_code, 201)
+        play_id = res.json()['id']
+
+        res = requests.get(url, params={'game': PlayTest.game_id, 'from_date': PlayTest.timestamp + 5000, 'to_date': PlayTest.timestamp + 5000, 'order': 'played_at'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([p['id'] for p in res.json()], [play_id])
+
+        res = requests.get(url, params={'game': '{}%'.format(PlayTest.game_id)})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.json()[0]['param'], 'game')
+
+        res = requests.get(url, params={'order': 'json_additional_data'})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.json()[0]['param'], 'order')
+
+    def test_conditional_get_plays(self):
+        """GET a play list again with its ETag, before and after adding a play. Expected: 304, then 200"""
+        res = requests.post('{}/users'.format(BASE_URL), json = {'name':'conditional_user', 'email': 'conditional_user@test.com', 'password': '12345'})
+        conditional_user_id = res.json()['id']
+        headers = UserTest.loginAs('conditional_user@test.com', '12345')
+
+        url = '{}/users/{}/plays'.format(BASE_URL, conditional_user_id)
+        res = requests.get(url)
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers['ETag']
+        res = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        res = requests.post(url, json = {'name': 'Conditional', 'additional_data': {'a': 'b'}, 'played_at': PlayTest.timestamp, 'game_id': PlayTest.game_id},
+                            headers=headers)
+        self.assertEqual(res.status_code, 201)
+        play_url = '{}/users/{}/plays/{}'.format(BASE_URL, conditional_user_id, res.json()['id'])
+
+        res = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        res = requests.get(play_url)
+        res = requests.get(play_url, headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
     def test_plays_list_options(self):
         """OPTIONS on /users/:id/plays should return GET, POST"""
         verbs = get_options_verbs('{}/users/{}/plays'.format(BASE_URL, PlayTest.user_id))